@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+from SprelfJSON import JSONModel
+
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from typing import Iterator
+import itertools
+import random
+
+from Data import Flight, Hop, Ticket, Trip, SeatType, FlightOptions, LegOptions, Passengers, \
+    LuggageSearchFilter, PriceSearchFilter, StopsSearchFilter, DurationSearchFilter, DepartureTimeSearchFilter
+from FlightCollector import GoogleSearchCollector, KLMSearchCollector
+from Planner import SearchPlan, QueryResult, CollectorJourneyRestriction, CollectorLegRestriction, DefaultRanker
+
+# Seeded synthetic data for the benchmarks.  Nothing here is fetched; the same seed and scale always
+# give the same plan and the same results.
+
+AIRPORTS = {"STR": "Europe/Berlin", "FRA": "Europe/Berlin", "MUC": "Europe/Berlin", "AMS": "Europe/Amsterdam",
+            "CDG": "Europe/Paris", "LHR": "Europe/London", "IST": "Europe/Istanbul", "DXB": "Asia/Dubai",
+            "DOH": "Asia/Qatar", "PEK": "Asia/Shanghai", "PVG": "Asia/Shanghai", "HKG": "Asia/Hong_Kong",
+            "HAN": "Asia/Ho_Chi_Minh", "SGN": "Asia/Ho_Chi_Minh", "BKK": "Asia/Bangkok", "NRT": "Asia/Tokyo",
+            "JFK": "America/New_York", "ORD": "America/Chicago", "SFO": "America/Los_Angeles",
+            "GRU": "America/Sao_Paulo"}
+HUBS = ["AMS", "CDG", "FRA", "IST", "DXB", "DOH", "HKG"]
+AIRLINES = ["KLM", "Air France", "Delta", "Lufthansa", "Qatar Airways", "Emirates", "Turkish Airlines",
+            "Vietnam Airlines", "Air China", "Cathay Pacific"]
+
+
+#
+
+
+class Scale(JSONModel):
+    routes: int  # origins and destinations per leg
+    legs: int
+    dates: int  # dates per leg
+    results_per_leg: int  # flights found for each leg search
+    trips: int  # QueryResults generated for the ranking/filtering/serialization cases
+    seed: int = 1
+
+
+SCALES = {
+    "small": Scale(routes=2, legs=2, dates=3, results_per_leg=10, trips=500),
+    "medium": Scale(routes=3, legs=2, dates=5, results_per_leg=20, trips=5_000),
+    "large": Scale(routes=3, legs=3, dates=5, results_per_leg=30, trips=20_000),
+}
+
+
+#
+
+
+def make_plan(scale: Scale) -> SearchPlan:
+    rnd = random.Random(scale.seed)
+    codes = list(AIRPORTS)
+    start = date(2026, 3, 1)
+
+    def _legs() -> list[LegOptions]:
+        legs, origins = [], rnd.sample(codes, scale.routes)
+        day = start + timedelta(days=rnd.randint(0, 30))
+        for _ in range(scale.legs):
+            destinations = rnd.sample([c for c in codes if c not in origins], scale.routes)
+            legs.append(LegOptions(origins=origins, destinations=destinations,
+                                   dates=[day + timedelta(days=i) for i in range(scale.dates)]))
+            origins, day = destinations, day + timedelta(days=rnd.randint(5, 15))
+        return legs
+
+    options = [FlightOptions(name=f"Option{i}", legs=_legs(), passengers=Passengers(adults=rnd.randint(1, 2)),
+                             currency="EUR",
+                             filters=[LuggageSearchFilter(checked=1), PriceSearchFilter(max=2500)])
+               for i in range(2)]
+    restricted = options[0].legs[0]
+    return SearchPlan(options=options,
+                      collectors=[KLMSearchCollector, GoogleSearchCollector],
+                      restrictions=[CollectorJourneyRestriction(collectors={KLMSearchCollector},
+                                                                origins=set(restricted.origins[:1]),
+                                                                destinations=set(options[0].legs[-1].destinations[:1])),
+                                    CollectorLegRestriction(collectors={GoogleSearchCollector},
+                                                            origins=set(restricted.origins[1:]),
+                                                            destinations=set(restricted.destinations[:1]))],
+                      ranker=DefaultRanker())
+
+
+def make_flight(rnd: random.Random, origin: str, destination: str, day: date) -> Flight:
+    stops = rnd.choices([0, 1, 2], weights=[3, 6, 2])[0]
+    points = [origin, *rnd.sample([h for h in HUBS if h not in (origin, destination)], stops), destination]
+    t = datetime.combine(day, time(rnd.randint(0, 23), rnd.choice([0, 15, 30, 45])), ZoneInfo(AIRPORTS[origin]))
+    seat = rnd.choices([SeatType.Economy, SeatType.Premium, SeatType.Business], weights=[8, 1, 1])[0]
+    hops = []
+    for i, (a, b) in enumerate(zip(points, points[1:])):
+        arrival = t + timedelta(minutes=rnd.randint(50, 720))
+        hops.append(Hop.trusted(origin=a, destination=b,
+                                departure_time=t,
+                                arrival_time=arrival.astimezone(ZoneInfo(AIRPORTS.get(b, "UTC"))),
+                                airline=rnd.choice(AIRLINES),
+                                tickets=[Ticket.trusted(price=float(rnd.randint(60, 1400)) if i == 0 else 0.0,
+                                                        currency="EUR", seat_type=seat,
+                                                        checked_bags=rnd.choice([0, 1, 1, 2]),
+                                                        carryon_bags=1)]))
+        t = arrival + timedelta(minutes=rnd.randint(45, 600))
+    return Flight.trusted(hops=hops)
+
+
+def make_leg_flights(scale: Scale, plan: SearchPlan) -> Iterator[list[list[Flight]]]:
+    # Flights per leg for each search of the plan, in plan order, endlessly
+    rnd = random.Random(scale.seed + 1)
+    searches = [s for fo in plan.options for s in fo.build_searches()]
+    for search in itertools.cycle(searches):
+        yield [[make_flight(rnd, leg.origin, leg.destination, leg.date) for _ in range(scale.results_per_leg)]
+               for leg in search.legs]
+
+
+def make_results(scale: Scale, plan: SearchPlan) -> list[QueryResult]:
+    rnd = random.Random(scale.seed + 2)
+    collectors = plan.collectors
+    results: list[QueryResult] = []
+    for flights in make_leg_flights(scale, plan):
+        # A sample of each search's combinations, roughly what a collector returns for one query
+        combos = list(itertools.islice(itertools.product(*flights), scale.results_per_leg * 4))
+        for combo in combos:
+            results.append(QueryResult(collector=rnd.choice(collectors), trip=Trip.trusted(flights=list(combo)),
+                                       key=f"bench-{len(results) // len(combos)}"))
+            if len(results) >= scale.trips:
+                return results
+    return results
+
+
+def make_filters() -> list:
+    return [LuggageSearchFilter(checked=1), PriceSearchFilter(max=2500), StopsSearchFilter(stops=1),
+            DurationSearchFilter(max=48 * 60), DepartureTimeSearchFilter(min=time(6), max=time(23))]
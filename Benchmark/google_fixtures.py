@@ -0,0 +1,114 @@
+from typing import Iterator
+import os
+import gzip
+import json
+import random
+
+# Writes the Google results pages under fixtures/google.  They're generated rather than captured so
+# they can be checked in and regenerated, but they only follow the markup the parser already reads
+# (the "best" and "other" result lists, one <li> per flight plus the trailing "more" item, and the
+# usual oddities: missing prices or times, layovers given in minutes only, a lot of unrelated markup
+# around it), so parsing them proves nothing about what Google actually serves.  Real pages go in
+# fixtures/google/captured, named ORIGIN-DESTINATION[-anything].html, or are read straight from a
+# tape recorded with Benchmark/replay.py --record; see captured() below.
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "google")
+CAPTURED_DIR = os.path.join(FIXTURE_DIR, "captured")
+PAGES = {"small": (1, 8), "medium": (2, 60), "large": (3, 250)}
+AIRLINES = ["KLM", "Air France", "Delta", "Lufthansa", "Qatar Airways", "Vietnam Airlines", "Air China",
+            "Turkish Airlines", "Emirates", "Swiss", "Finnair", "Cathay Pacific"]
+AIRPORTS = ["AMS", "CDG", "DXB", "IST", "FRA", "MUC", "DOH", "HEL", "ZRH", "HKG", "PVG", "BKK"]
+DAYS = [("Sun", "Dec", 21), ("Mon", "Dec", 22), ("Tue", "Dec", 23)]
+
+
+def _time(rnd: random.Random, day: tuple[str, str, int]) -> str:
+    h, m = rnd.randint(1, 12), rnd.choice([0, 5, 10, 15, 20, 30, 35, 40, 45, 50, 55])
+    # Google pads with narrow no-break spaces, which the parser collapses
+    return f"{h}:{m:02d} {rnd.choice(['AM', 'PM'])} on {day[0]}, {day[1]} {day[2]}"
+
+
+def _layover(rnd: random.Random) -> str:
+    airport = rnd.choice(AIRPORTS)
+    match rnd.randint(0, 5):
+        case 0:
+            return f"{rnd.randint(20, 55)} min {airport}"
+        case 1:
+            return f"{rnd.randint(1, 9)} hr {airport}"
+        case _:
+            return f"{rnd.randint(1, 14)} hr {rnd.randint(1, 59)} min {airport}"
+
+
+def _item(rnd: random.Random) -> str:
+    stops = rnd.choices([0, 1, 2, 3], weights=[4, 8, 4, 1])[0]
+    airlines = ", ".join(rnd.sample(AIRLINES, rnd.randint(1, max(1, stops + 1))))
+    stop_str = "Nonstop" if stops == 0 else f"{stops} stop{'s' if stops > 1 else ''}"
+    layovers = ", ".join(_layover(rnd) for _ in range(stops))
+    dep_day = DAYS[0]
+    arr_day = DAYS[rnd.choice([0, 1, 1, 2])]
+    hours, minutes = rnd.randint(2, 40), rnd.randint(0, 59)
+    price = "Price unavailable" if rnd.random() < 0.03 else f"€{rnd.randint(90, 2400):,}".replace(",", "")
+    times = "" if rnd.random() < 0.02 else \
+        f'<div aria-label="Departure time">{_time(rnd, dep_day)}</div>' \
+        f'<div aria-label="Arrival time">{_time(rnd, arr_day)}</div>'
+    return f'''<li class="pIav2d"><div class="yR1fYc" jsaction="click:O1htCb" role="link" tabindex="0">
+<div class="mxvQLc ceis6c uj4xv uVdL1c A8qKrc" jsname="BXUrOb"><div class="JMc5Xc" aria-label="From {price}. {stop_str} flight with {airlines}."></div>
+<div class="gQ6yfe m7VU8c"><div class="x8klId I11szd"><img class="EbY4Pc P2UJoe" src="data:image/png;base64,iVBORw0KGgo=" alt=""></div>
+<div class="Ir0Voe"><div class="zxVSec YMlIz tPgKwe ogfYpf"><span class="mv1WYe" aria-label="Leaves and arrives">{times}</span>
+{'<span class="bOzv6" aria-label="Arrives next day">+1</span>' if arr_day != dep_day else ''}</div>
+<div class="sSHqwe tPgKwe ogfYpf"><span>{airlines}</span><span class="h1fkLb">Operated by partner</span></div></div>
+<div class="Ak5kof"><div class="gvkrdb AdWm1c tPgKwe ogfYpf" aria-label="Total duration {hours} hr {minutes} min.">{hours} hr {minutes} min</div>
+<div class="PTuQse sSHqwe tPgKwe ogfYpf"><span jscontroller="cNtv4b">{AIRPORTS[0]}</span>–<span>{AIRPORTS[1]}</span></div></div>
+<div class="BbR8Ec"><div class="EfT7Ae AdWm1c tPgKwe"><span class="ogfYpf" aria-label="{stop_str} flight.">{stop_str}</span></div>
+<div class="sSHqwe tPgKwe ogfYpf">{layovers}</div></div>
+<div class="J0g6mf"><span class="GsCCve">{'Often delayed by 30+ min' if rnd.random() < 0.1 else ''}</span></div>
+<div class="U3gSDe"><div class="BVAVmf I11szd POX3ye"><div class="YMlIz FpEdX"><span aria-label="{price} euros">{price}</span></div>
+<div class="N872Rd sSHqwe u4dC2b">round trip</div></div></div></div></div></div></li>'''
+
+
+def page(seed: int, n: int) -> str:
+    rnd = random.Random(seed)
+    best = "".join(_item(rnd) for _ in range(min(4, n))) + '<li class="ZVk93d"><div>Other departing flights</div></li>'
+    other = "".join(_item(rnd) for _ in range(n)) + '<li class="ZVk93d"><button>View more flights</button></li>'
+    noise = "".join(f'<div class="ZmBRkd"><script nonce="x">var _{i}={{"k":[{i},null,"{"x" * 40}"]}};</script>'
+                    f'<div class="gws-flights__{i}" aria-hidden="true"></div></div>' for i in range(40))
+    return f'''<!DOCTYPE html><html lang="en-US"><head><meta charset="utf-8"><title>Google Flights</title>
+<style>.Rk10dc{{list-style:none}}</style></head><body>{noise}
+<div role="main"><div class="FXkZv"><h3 class="zBTtmb ZSxxwc">Top departing flights</h3>
+<div jsname="IWWDBc"><ul class="Rk10dc">{best}</ul></div>
+<h3 class="zBTtmb ZSxxwc">Other departing flights</h3>
+<div jsname="YdtKid"><ul class="Rk10dc">{other}</ul></div></div></div>{noise}</body></html>'''
+
+
+def captured(tape: str | None = None) -> Iterator[tuple[str, str, str, str]]:
+    # Real result pages as (name, html, origin, destination): the files under CAPTURED_DIR, then
+    # every Google page saved on `tape` (its keys are "google|ORIGIN|DESTINATION|date|...")
+    if os.path.isdir(CAPTURED_DIR):
+        for name in sorted(os.listdir(CAPTURED_DIR)):
+            if name.endswith(".html"):
+                with open(os.path.join(CAPTURED_DIR, name), "r", encoding="utf-8") as f:
+                    html = f.read()
+                route = name[:-len(".html")].split("-")
+                yield name, html, route[0].upper(), (route[1] if len(route) > 1 else "").upper()
+    if tape is not None and os.path.isdir(tape):
+        for name in sorted(os.listdir(tape)):
+            if not name.endswith(".json.gz"):
+                continue
+            with gzip.open(os.path.join(tape, name), "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry.get("collector") == "GoogleSearchCollector" and isinstance(entry.get("value"), str):
+                parts = entry["key"].split("|")
+                yield name, entry["value"], parts[1], parts[2]
+
+
+def main():
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    for name, (seed, n) in PAGES.items():
+        with open(os.path.join(FIXTURE_DIR, f"{name}.html"), "w", encoding="utf-8") as f:
+            f.write(page(seed, n))
+
+
+#
+
+
+if __name__ == '__main__':
+    main()
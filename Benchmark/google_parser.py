@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+
+from fast_flights.core import parse_response
+
+from Data import SeatType, Flight
+from FlightCollector.Providers.Google import _parse_page, _parse_date
+
+from google_fixtures import FIXTURE_DIR, captured
+
+# Parser throughput over the saved result pages (see google_fixtures.py), run with src/ on the path:
+#   PYTHONPATH=src python Benchmark/google_parser.py [--repeat N] [--json out.json] [--tape DIR] [--check]
+# --check compares the real captured pages (see google_fixtures.captured) against fast_flights' own
+# parser.  The generated fixtures are left out of it: they're shaped to match the parser, so they
+# can't show it's wrong, and until some real pages are captured the check has nothing to go on.
+
+
+class _Page:
+    # The one part of a fast_flights Response that its parser reads
+    def __init__(self, text: str):
+        self.text = text
+
+
+def bench(path: str, repeat: int) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        html = f.read()
+    return _bench(os.path.basename(path), html, repeat)
+
+
+def _bench(fixture: str, html: str, repeat: int, origin: str = "STR", destination: str = "PEK") -> dict:
+    def parse():
+        return _parse_page(html, origin=origin, destination=destination, seat=SeatType.Economy)
+
+    flights = len(list(parse()))  # warm-up; also fills the date caches like a real run would
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in parse():
+            pass
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {"fixture": fixture,
+            "bytes": len(html),
+            "flights": flights,
+            "best_seconds": best,
+            "mean_seconds": sum(times) / len(times),
+            "flights_per_second": flights / best if best > 0 else 0.0}
+
+
+def check(html: str, origin: str = "STR", destination: str = "PEK") -> list[str]:
+    # Differences between _parse_page and fast_flights' parser, which reads each field with its own
+    # selector instead of sorting one query's matches by class.  Both drop the trailing "more" item
+    # of each list and anything without a price or times.
+    try:
+        reference = parse_response(_Page(html), dangerously_allow_looping_last_item=True).flights
+    except RuntimeError:
+        reference = []
+    expected = []
+    for _, group in itertools.groupby(reference, key=lambda f: f.is_best):
+        for f in list(group)[:-1]:
+            try:
+                price = float(f.price[1:])
+            except ValueError:
+                continue
+            if f.departure and f.arrival:
+                expected.append((f.is_best, f.name.split(",")[0].strip(), price, f.price[0],
+                                 _parse_date(f.departure), _parse_date(f.arrival),
+                                 f.stops if isinstance(f.stops, int) else None))
+
+    def _fields(flight: Flight, stops: int | None) -> tuple:
+        first, last = flight.hops[0], flight.hops[-1]
+        return (flight.info["is_best"], first.airline, first.tickets[0].price, first.tickets[0].currency,
+                first.departure_time.replace(tzinfo=None), last.arrival_time.replace(tzinfo=None),
+                None if stops is None else len(flight.hops) - 1)
+
+    parsed = list(_parse_page(html, origin=origin, destination=destination, seat=SeatType.Economy))
+    differences = [f"{len(parsed)} flights parsed, {len(expected)} expected"] if len(parsed) != len(expected) else []
+    for k, (flight, e) in enumerate(zip(parsed, expected)):
+        if (got := _fields(flight, e[-1])) != e:
+            differences.append(f"flight {k}: {got} != {e}")
+    return differences
+
+
+def main():
+    args = argparse.ArgumentParser(description="Google results parser throughput")
+    args.add_argument("--repeat", type=int, default=20)
+    args.add_argument("--json", help="also write the results to this file")
+    args.add_argument("--tape", help="also use the Google pages recorded on this tape")
+    args.add_argument("--check", action="store_true", help="compare the captured pages against fast_flights' parser")
+    opts = args.parse_args()
+
+    pages = [(name, open(os.path.join(FIXTURE_DIR, name), "r", encoding="utf-8").read(), "STR", "PEK")
+             for name in sorted(os.listdir(FIXTURE_DIR)) if name.endswith(".html")]
+    real = list(captured(opts.tape))
+    pages += real
+
+    if opts.check:
+        if not real:
+            print("No captured pages found, so nothing was checked; the generated fixtures are shaped "
+                  "to match the parser")
+        failed = False
+        for name, html, origin, destination in real:
+            differences = check(html, origin, destination)
+            print(f"{name:>14}: {'ok' if not differences else f'{len(differences)} differences'}")
+            for d in differences[:10]:
+                print(f"{'':>16}{d}")
+            failed = failed or bool(differences)
+        if failed:
+            sys.exit(1)
+
+    results = [_bench(name, html, opts.repeat, origin, destination) for name, html, origin, destination in pages]
+    for r in results:
+        print(f"{r['fixture']:>14}: {r['flights']:5d} flights, {r['best_seconds'] * 1000:8.2f} ms, "
+              f"{r['flights_per_second']:10.0f} flights/s")
+    total_flights = sum(r["flights"] for r in results)
+    total_seconds = sum(r["best_seconds"] for r in results)
+    print(f"{'total':>14}: {total_flights:5d} flights, {total_seconds * 1000:8.2f} ms, "
+          f"{total_flights / total_seconds:10.0f} flights/s")
+
+    if opts.json:
+        with open(opts.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version, "results": results}, f, indent=2)
+
+
+#
+
+
+if __name__ == '__main__':
+    main()
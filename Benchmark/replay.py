@@ -0,0 +1,74 @@
+import os
+import time
+import argparse
+
+from ruamel.yaml import YAML
+
+from FlightCollector import FlightCollector, KLMSearchCollector, MemoryCache, Metrics, Tape, ReplayConditions, \
+    SharedRateLimiter
+from Planner import SearchPlan
+
+# Runs a search plan end-to-end against recorded provider responses, run with src/ on the path:
+#   PYTHONPATH=src python Benchmark/replay.py data/plan.yaml data/tape --record      (live, saves responses)
+#   PYTHONPATH=src python Benchmark/replay.py data/plan.yaml data/tape --workers 8 --latency-scale 0.5
+# Replays need no network (or browser, or API key), so concurrency, caching and scheduling changes
+# can be compared on the same responses under the same simulated conditions.
+
+
+def main():
+    args = argparse.ArgumentParser(description="Plan run against a tape of recorded responses")
+    args.add_argument("plan", help="plan yaml")
+    args.add_argument("tape", help="directory of recorded responses")
+    args.add_argument("--record", action="store_true", help="make the real requests and record them")
+    args.add_argument("--workers", type=int, default=None, help="overrides the plan's workers")
+    args.add_argument("--cache", choices=["none", "memory"], default="none",
+                      help="fetch cache in front of the tape (the disk cache is never used here)")
+    args.add_argument("--latency-scale", type=float, default=1.0)
+    args.add_argument("--latency-mean", type=float, default=None)
+    args.add_argument("--latency-sigma", type=float, default=0.0)
+    args.add_argument("--error-rate", type=float, default=0.0)
+    args.add_argument("--rate-limit", default=None, help="CALLS/SECONDS allowed per collector, e.g. 2/1.5")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--json", help="write the metrics report to this file")
+    opts = args.parse_args()
+
+    yaml = YAML(typ="safe")
+    with open(opts.plan, "r", encoding="utf-8") as f:
+        plan = SearchPlan.from_json(yaml.load(f))
+    if opts.workers is not None:
+        plan.workers = opts.workers
+    FlightCollector.CACHE = MemoryCache(max_entries=100_000) if opts.cache == "memory" else None
+
+    calls, period = (None, 1.0) if opts.rate_limit is None else opts.rate_limit.split("/")
+    conditions = ReplayConditions(latency_scale=opts.latency_scale, latency_mean=opts.latency_mean,
+                                  latency_sigma=opts.latency_sigma, error_rate=opts.error_rate,
+                                  rate_limit_calls=None if calls is None else int(calls),
+                                  rate_limit_period=float(period))
+    if opts.record:
+        tape = Tape.recording(opts.tape)
+    else:
+        if KLMSearchCollector.API_KEY is None:
+            KLMSearchCollector.API_KEY = "replay"
+        # Simulated 429s shouldn't slow down the limiter that real runs share
+        KLMSearchCollector.RATE_LIMITER = SharedRateLimiter("klm", rate=KLMSearchCollector.RATE_LIMITER.max_rate,
+                                                            path=":memory:")
+        tape = Tape.replaying(opts.tape, conditions=conditions, seed=opts.seed)
+
+    start = time.perf_counter()
+    with tape, Metrics.activate() as metrics:
+        results = list(plan.search())
+    elapsed = time.perf_counter() - start
+
+    print(metrics)
+    print(f"\n{sum(len(r.results) for r in results)} results from {len(results)} plans in {elapsed:.2f}s "
+          f"({plan.workers} workers)")
+    if opts.json:
+        os.makedirs(os.path.dirname(os.path.abspath(opts.json)), exist_ok=True)
+        metrics.write(opts.json)
+
+
+#
+
+
+if __name__ == '__main__':
+    main()
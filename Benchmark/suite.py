@@ -0,0 +1,169 @@
+import io
+import copy
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from typing import Callable, Any
+
+from ruamel.yaml import YAML
+
+from Data import SearchFilter, TripBatch
+from Planner import PlannedQuery, PlanResult, SearchRestriction, ParetoPruner, write_results, ResultFile
+
+from generator import SCALES, Scale, make_plan, make_results, make_filters
+import google_parser
+
+# Times the planner's hot paths on seeded synthetic data, run with src/ on the path:
+#   PYTHONPATH=src python Benchmark/suite.py [--scale medium] [--json out.json] [--compare old.json]
+# The JSON output is meant to be kept per commit and compared with --compare.
+
+yaml = YAML(typ="safe")
+yaml.allow_unicode = True
+yaml.default_flow_style = False
+yaml.indent(mapping=2, sequence=4, offset=2)
+
+
+#
+
+
+def timed(repeat: int, run: Callable[[Any], int], setup: Callable[[], Any] = lambda: None) -> dict:
+    # `run` gets whatever `setup` made (untimed, fresh for every repeat) and returns how many items it handled
+    times, items = [], 0
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        items = run(state)
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {"items": items,
+            "best_seconds": best,
+            "mean_seconds": sum(times) / len(times),
+            "items_per_second": items / best if best > 0 else 0.0}
+
+
+def run_suite(scale: Scale, repeat: int) -> dict[str, dict]:
+    plan = make_plan(scale)
+    results = make_results(scale, plan)
+    trips = [r.trip for r in results]
+    filters = make_filters()
+    ranked = plan.ranker.rank(results)
+    plan_result = PlanResult(name="bench", results=ranked)
+    plan_json = plan_result.to_json()
+    plan_yaml = _dump_yaml(plan_json)
+    cases: dict[str, dict] = {}
+
+    def _case(name: str, run: Callable[[Any], int], setup: Callable[[], Any] = lambda: None, n: int = repeat):
+        print(f"  {name}...", end="", flush=True)
+        cases[name] = timed(n, run, setup)
+        print(f" {cases[name]['best_seconds'] * 1000:.1f} ms")
+
+    _case("build_searches", lambda _: sum(1 for fo in plan.options for _ in fo.build_searches()))
+    # Restrictions mutate the query they're given, so every repeat gets new ones
+    _case("restrictions_apply",
+          lambda queries: sum(1 for q in queries if SearchRestriction.apply(q, *plan.restrictions)),
+          setup=lambda: [PlannedQuery(collector=c, search=s) for fo in plan.options
+                         for s in fo.build_searches() for c in plan.collectors])
+    _case("plan_queries", lambda _: sum(1 for fo in plan.options for _ in plan.queries(fo)))
+    _case("filter_trips", lambda _: len(SearchFilter.filter_trips(filters, trips)) and len(trips))
+    # The per-flight path drops unsuitable tickets from the flights it checks, so it gets copies
+    _case("filter_per_flight",
+          lambda copies: sum(1 for t in copies if all(f.filter(fl) for f in filters for fl in t.flights)) and len(trips),
+          setup=lambda: copy.deepcopy(trips))
+    _case("trip_batch", lambda _: len(TripBatch(trips).cheapest))
+    _case("rank", lambda _: len(plan.ranker.rank(results)))
+    _case("rank_top_100", lambda _: len(plan.ranker.rank(results, top_k=100)) and len(results))
+    _case("pareto_prune", lambda _: len(ParetoPruner(epsilon=0.05).prune(results)) and len(results))
+    _case("to_json", lambda _: len(plan_result.to_json()["results"]))
+    _case("from_json", lambda _: len(PlanResult.from_json(plan_json).results))
+    _case("yaml_dump", lambda _: len(_dump_yaml(plan_json)) and len(ranked), n=1)
+    _case("yaml_load", lambda _: len(PlanResult.from_json(yaml.load(plan_yaml)).results), n=1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.flr")
+        _case("result_file_write", lambda _: write_results(path, [plan_result]) or len(ranked))
+        _case("result_file_load", lambda _: _load_file(path))
+        _case("result_file_top_100", lambda _: _load_file(path, 100))
+
+    for fixture in sorted(os.listdir(google_parser.FIXTURE_DIR)):
+        if fixture.endswith(".html"):
+            r = google_parser.bench(os.path.join(google_parser.FIXTURE_DIR, fixture), repeat)
+            cases[f"google_parse_{os.path.splitext(fixture)[0]}"] = \
+                {"items": r["flights"], "best_seconds": r["best_seconds"], "mean_seconds": r["mean_seconds"],
+                 "items_per_second": r["flights_per_second"]}
+    return cases
+
+
+def _dump_yaml(data: dict) -> str:
+    out = io.StringIO()
+    yaml.dump(data, out)
+    return out.getvalue()
+
+
+def _load_file(path: str, limit: int | None = None) -> int:
+    with ResultFile(path) as rf:
+        return sum(len(pr.results) for pr in rf.load(limit))
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(cases: dict[str, dict], previous: dict[str, dict]):
+    print(f"\n{'case':>24} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for name, case in cases.items():
+        if name not in previous:
+            continue
+        before, after = previous[name]["best_seconds"], case["best_seconds"]
+        change = (after - before) / before * 100 if before > 0 else 0.0
+        print(f"{name:>24} {before * 1000:10.2f} {after * 1000:10.2f} {change:+7.1f}%")
+
+
+def main():
+    args = argparse.ArgumentParser(description="Planner benchmarks on synthetic data")
+    args.add_argument("--scale", choices=list(SCALES), default="small")
+    args.add_argument("--seed", type=int, default=None)
+    args.add_argument("--repeat", type=int, default=5)
+    args.add_argument("--json", help="write the results to this file")
+    args.add_argument("--compare", help="results file of an earlier run to compare against")
+    opts = args.parse_args()
+
+    scale = SCALES[opts.scale]
+    if opts.seed is not None:
+        scale = Scale.from_json({**scale.to_json(), "seed": opts.seed})
+    print(f"Scale {opts.scale}: {scale.to_json()}")
+    cases = run_suite(scale, opts.repeat)
+
+    print(f"\n{'case':>24} {'items':>8} {'best ms':>10} {'items/s':>12}")
+    for name, case in cases.items():
+        print(f"{name:>24} {case['items']:8d} {case['best_seconds'] * 1000:10.2f} {case['items_per_second']:12.0f}")
+
+    if opts.compare:
+        with open(opts.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous.get("parameters") != scale.to_json():
+            print(f"\nNote: {opts.compare} was run at a different scale ({previous.get('parameters')})")
+        compare(cases, previous["cases"])
+
+    if opts.json:
+        with open(opts.json, "w", encoding="utf-8") as f:
+            json.dump({"commit": _commit(),
+                       "python": sys.version,
+                       "scale": opts.scale,
+                       "parameters": scale.to_json(),
+                       "repeat": opts.repeat,
+                       "cases": cases}, f, indent=2)
+
+
+#
+
+
+if __name__ == '__main__':
+    main()
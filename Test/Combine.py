@@ -6,18 +6,15 @@ from ruamel.yaml import YAML
 yaml = YAML(typ="safe")
 yaml.allow_unicode = True
 yaml.default_flow_style = False
-yaml.indent(mapping=2, sequence=2, offset=4)
+yaml.indent(mapping=2, sequence=4, offset=2)
 
 F1 = "../data/results_2025-09-27.yaml"
 F2 = "../data/results_2025-09-27_copy.yaml"
 OUT = "../data/results_2025-09-27_combined.yaml"
 
 def main():
-    with open(F1, "r", encoding="utf-8") as f:
-        f1 = [PlanResult.from_json(group) for group in yaml.load(f)["results"]]
-
-    with open(F2, "r", encoding="utf-8") as f:
-        f2 = [PlanResult.from_json(group) for group in yaml.load(f)["results"]]
+    f1 = load_results(F1)
+    f2 = load_results(F2)
 
     combined: list[PlanResult] = []
     for pr1, pr2 in zip(f1, f2):
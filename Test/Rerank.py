@@ -6,7 +6,7 @@ from ruamel.yaml import YAML
 yaml = YAML(typ="safe")
 yaml.allow_unicode = True
 yaml.default_flow_style = False
-yaml.indent(mapping=2, sequence=2, offset=4)
+yaml.indent(mapping=2, sequence=4, offset=2)
 
 FILE = "../data/results_2025-09-30.yaml"
 OUT = "../data/results_2025-09-30_revised.yaml"
@@ -18,10 +18,7 @@ def main():
     with open(PLAN, "r", encoding="utf-8") as f:
         plan = SearchPlan.from_json(yaml.load(f))
 
-    with open(FILE, "r", encoding="utf-8") as f:
-        results = yaml.load(f)["results"]
-
-    plan_results = [PlanResult.from_json(group) for group in results]
+    plan_results = load_results(FILE)
     for i, result in enumerate(plan_results):
         revised = plan.ranker.rank(sqr.query for sqr in result.results)
         plan_results[i].results = revised
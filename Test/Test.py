@@ -1,5 +1,7 @@
 import os
 import io
+import glob
+import contextlib
 from FlightCollector import *
 from Planner import *
 from Data import *
@@ -9,21 +11,54 @@ from datetime import datetime
 yaml = YAML(typ="safe")
 yaml.allow_unicode = True
 yaml.default_flow_style = False
-yaml.indent(mapping=2, sequence=2, offset=4)
+yaml.indent(mapping=2, sequence=4, offset=2)
 
 DATA_DIR = "../data"
 D_FORMAT = "%a %d %b, %Y (%H:%M)"
 TODAY = datetime.today()
+REFRESH = True  # only re-search what's gone stale since the latest results file
+TRACE_MEMORY = False  # adds tracemalloc peaks to the metrics report, at some cost in speed
+TAPE_DIR = None  # e.g. "../data/tape" to record raw responses for Benchmark/replay.py (cache misses only)
+
+
+def load_previous() -> list[PlanResult]:
+    # Latest results, from the binary file when there is one since it loads much faster
+    files = sorted(glob.glob(os.path.join(DATA_DIR, "results_????-??-??.yaml")) +
+                   glob.glob(os.path.join(DATA_DIR, "results_????-??-??.flr")),
+                   key=lambda p: (os.path.splitext(p)[0], p.endswith(".flr")))
+    if not REFRESH or not files:
+        return []
+    return load_results(files[-1])
+
 
 def main():
     with open(os.path.join(DATA_DIR, "plan.yaml"), "r", encoding="utf-8") as f:
         plan = SearchPlan.from_json(yaml.load(f))
 
     f_name = f"results_{TODAY.strftime('%Y-%m-%d')}"
-    results = list(plan.search())
+    stream = os.path.join(DATA_DIR, f"{f_name}.jsonl")
+    # Refresh the latest results, picking up today's run where it stopped if it was interrupted
+    previous = load_previous()
+    if os.path.exists(stream):
+        previous = JSONLinesSink.load(stream, ranker=plan.ranker, pruner=plan.pruner, top_k=plan.top_k,
+                                      previous=previous)
+    tape = Tape.recording(TAPE_DIR) if TAPE_DIR is not None else contextlib.nullcontext()
+    with tape, Metrics.activate(trace_memory=TRACE_MEMORY) as metrics:
+        with JSONLinesSink(stream) as sink:
+            for result in plan.refresh(previous, sink=sink):
+                print(f"Finished plan \"{result.name}\" ({len(result.results)} results, "
+                      f"{len(result.skipped)} queries skipped, {len(result.failed)} failed)")
+
+        write_reports(f_name, JSONLinesSink.load(stream, ranker=plan.ranker, pruner=plan.pruner, top_k=plan.top_k))
+    metrics.write(os.path.join(DATA_DIR, f"{f_name}.metrics.json"))
+    print(metrics)
+
+
+def write_reports(f_name: str, results: list[PlanResult]):
     with open(os.path.join(DATA_DIR, f"{f_name}.yaml"), "w", encoding="utf-8") as f:
         out = {"results": [r.to_json() for r in results]}
         yaml.dump(out, f)
+    write_results(os.path.join(DATA_DIR, f"{f_name}.flr"), results)
 
     with open(os.path.join(DATA_DIR, f"{f_name}.txt"), "w", encoding="utf-8") as f:
         for result in results:
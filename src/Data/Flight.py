@@ -3,16 +3,43 @@ from __future__ import annotations
 from SprelfJSON import JSONModel, JSONObject, ModelElem
 
 from datetime import timedelta, datetime, date
-from typing import Iterator
+from typing import Iterator, Any, Callable, Self, TypeVar
 import itertools
 
 from Data.Enums import SeatType, JourneyType
 
+T = TypeVar("T")
+_STAMPS = itertools.count()
+
+
+#
+
+
+class _Trusted:
+    # Builds a model straight from already-valid values, skipping JSONModel validation and any
+    # checks in __init__.  Meant for collectors that construct thousands of objects they control.
+    __trusted_defaults__: dict[type, dict[str, Any]] = {}
+
+    @classmethod
+    def trusted(cls, **kwargs) -> Self:
+        defaults = _Trusted.__trusted_defaults__.get(cls)
+        if defaults is None:
+            defaults = _Trusted.__trusted_defaults__[cls] = \
+                {k: elem for k, elem in cls.model().items() if elem.has_default()}
+        obj = cls.__new__(cls)
+        obj.__dict__.update({k: elem.default for k, elem in defaults.items() if k not in kwargs})
+        obj.__dict__.update(kwargs)
+        obj._changed()
+        return obj
+
+    def _changed(self):
+        ...
+
 
 #
 
 
-class Layover(JSONModel):
+class Layover(JSONModel, _Trusted):
     location: str
     start_time: datetime
     end_time: datetime
@@ -25,7 +52,7 @@ class Layover(JSONModel):
 #
 
 
-class Ticket(JSONModel):
+class Ticket(JSONModel, _Trusted):
     price: float
     currency: str
     checked_bags: int
@@ -36,13 +63,14 @@ class Ticket(JSONModel):
 #
 
 
-class Hop(JSONModel):
+class Hop(JSONModel, _Trusted):
     origin: str
     destination: str
     departure_time: datetime
     arrival_time: datetime
     airline: str
     tickets: list[Ticket]
+    _stamp: int = -1
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -52,6 +80,15 @@ class Hop(JSONModel):
             raise ValueError("Tickets must all have the same currency")
         self.tickets = sorted(self.tickets, key=lambda t: t.price)
 
+    def __setattr__(self, key: str, value: Any):
+        super().__setattr__(key, value)
+        if key[0] != "_":
+            self._changed()
+
+    def _changed(self):
+        # Flights compare these stamps to know when their cached values have gone stale
+        self._stamp = next(_STAMPS)
+
     @property
     def duration(self) -> timedelta:
         return self.arrival_time - self.departure_time
@@ -73,9 +110,11 @@ class Hop(JSONModel):
 #
 
 
-class Flight(JSONModel):
+class Flight(JSONModel, _Trusted):
     hops: list[Hop]
     info: dict = dict()
+    _cache: dict[str, Any] = {}
+    _cache_stamps: tuple[int, ...] | None = None
 
     class _Details(JSONModel):
         origin: str
@@ -96,6 +135,25 @@ class Flight(JSONModel):
             if hop1.currency != hop2.currency:
                 raise ValueError("Flight legs have different ticket currencies")
 
+    def __setattr__(self, key: str, value: Any):
+        super().__setattr__(key, value)
+        if key[0] != "_":
+            self._changed()
+
+    def _changed(self):
+        self._cache_stamps = None
+
+    def _cached(self, name: str, compute: Callable[[], T]) -> T:
+        stamps = tuple(hop._stamp for hop in self.hops)
+        if stamps != self._cache_stamps:
+            self._cache = {}
+            self._cache_stamps = stamps
+        try:
+            return self._cache[name]
+        except KeyError:
+            value = self._cache[name] = compute()
+            return value
+
     def to_json(self, **kwargs) -> JSONObject:
         j = super().to_json(**kwargs)
         j["details"] = Flight._Details(origin=self.origin,
@@ -129,7 +187,7 @@ class Flight(JSONModel):
 
     @property
     def duration(self) -> timedelta:
-        return self.arrival_time - self.departure_time
+        return self._cached("duration", lambda: self.arrival_time - self.departure_time)
 
     @property
     def duration_str(self) -> str:
@@ -142,44 +200,48 @@ class Flight(JSONModel):
 
     @property
     def layovers(self) -> list[Layover]:
-        return [Layover(location=hop2.origin,
-                        start_time=hop1.arrival_time,
-                        end_time=hop2.departure_time)
-                for hop1, hop2 in itertools.pairwise(self.hops)]
+        return list(self._cached("layovers", lambda: tuple(
+            Layover.trusted(location=hop2.origin,
+                            start_time=hop1.arrival_time,
+                            end_time=hop2.departure_time)
+            for hop1, hop2 in itertools.pairwise(self.hops))))
 
     @property
     def layover_time(self) -> timedelta:
-        return sum((lo.duration for lo in self.layovers), timedelta(minutes=0))
+        return self._cached("layover_time",
+                            lambda: sum((lo.duration for lo in self.layovers), timedelta(minutes=0)))
 
     @property
     def in_air_time(self) -> timedelta:
         return self.duration - self.layover_time
 
     def cheapest_tickets(self) -> list[Ticket]:
-        return [hop.cheapest() for hop in self.hops]
+        return list(self._cached("cheapest_tickets", lambda: tuple(hop.cheapest() for hop in self.hops)))
 
     def cheapest(self) -> float:
-        return sum(t.price for t in self.cheapest_tickets())
+        return self._cached("cheapest", lambda: sum(t.price for t in self.cheapest_tickets()))
 
     def tickets(self, seat_type: SeatType) -> list[Ticket]:
         return [hop.ticket(seat_type) for hop in self.hops]
 
     def seats(self) -> list[SeatType]:
-        return list({hop.cheapest().seat_type for hop in self.hops})
+        return list(self._cached("seats", lambda: {hop.cheapest().seat_type for hop in self.hops}))
 
     def stops(self) -> tuple[str, ...]:
-        stops = tuple()
-        for hop in self.hops:
-            if len(stops) == 0 or stops[-1] != hop.origin:
-                stops += (hop.origin,)
-            stops += (hop.destination,)
-        return stops
+        def _stops() -> tuple[str, ...]:
+            stops = tuple()
+            for hop in self.hops:
+                if len(stops) == 0 or stops[-1] != hop.origin:
+                    stops += (hop.origin,)
+                stops += (hop.destination,)
+            return stops
+        return self._cached("stops", _stops)
 
 
 #
 
 
-class Trip(JSONModel):
+class Trip(JSONModel, _Trusted):
     flights: list[Flight]
 
     class _Details(JSONModel):
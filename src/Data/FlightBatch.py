@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from datetime import datetime
+from functools import cached_property
+from typing import Sequence, Iterable
+import numpy as np
+
+from Data.Flight import Flight, Trip
+
+
+#
+
+
+class FlightBatch:
+    # Column view over a list of flights, so filters can be evaluated as array operations.
+    # Columns are only built the first time something asks for them.
+
+    def __init__(self, flights: Sequence[Flight]):
+        self.flights = list(flights)
+
+    def __len__(self) -> int:
+        return len(self.flights)
+
+    def _column(self, values: Iterable, dtype: type) -> np.ndarray:
+        return np.fromiter(values, dtype=dtype, count=len(self.flights))
+
+    @cached_property
+    def departure(self) -> np.ndarray:
+        return self._column((f.departure_time.timestamp() for f in self.flights), float)
+
+    @cached_property
+    def arrival(self) -> np.ndarray:
+        return self._column((f.arrival_time.timestamp() for f in self.flights), float)
+
+    @cached_property
+    def departure_of_day(self) -> np.ndarray:
+        return self._column((_seconds_of_day(f.departure_time) for f in self.flights), float)
+
+    @cached_property
+    def arrival_of_day(self) -> np.ndarray:
+        return self._column((_seconds_of_day(f.arrival_time) for f in self.flights), float)
+
+    @cached_property
+    def duration(self) -> np.ndarray:
+        return self._column((f.duration.total_seconds() for f in self.flights), float)
+
+    @cached_property
+    def stops(self) -> np.ndarray:
+        return self._column((len(f.hops) - 1 for f in self.flights), int)
+
+    @cached_property
+    def cheapest(self) -> np.ndarray:
+        return self._column((f.cheapest() for f in self.flights), float)
+
+    @cached_property
+    def currency(self) -> np.ndarray:
+        return np.array([f.currency for f in self.flights], dtype=object)
+
+    @cached_property
+    def hop_count(self) -> int:
+        return sum(len(f.hops) for f in self.flights)
+
+    @cached_property
+    def hop_starts(self) -> np.ndarray:
+        counts = self._column((len(f.hops) for f in self.flights), np.intp)
+        return np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.intp)
+
+    @cached_property
+    def tickets(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (hop index, checked bags, carry-on bags) for every ticket of every hop
+        hops, checked, carryon = [], [], []
+        for i, hop in enumerate(h for f in self.flights for h in f.hops):
+            for t in hop.tickets:
+                hops.append(i)
+                checked.append(t.checked_bags)
+                carryon.append(t.carryon_bags)
+        return np.array(hops, dtype=np.intp), np.array(checked, dtype=int), np.array(carryon, dtype=int)
+
+    def invalidate(self):
+        # Drops the columns built so far, for when the flights were changed in place
+        for name in [k for k in vars(self) if isinstance(getattr(type(self), k, None), cached_property)]:
+            del self.__dict__[name]
+
+    def per_hop(self, hop_mask: np.ndarray) -> np.ndarray:
+        # Collapse a per-hop mask to a per-flight one: a flight passes if all of its hops do
+        if len(self.flights) == 0:
+            return np.ones(0, dtype=bool)
+        return np.logical_and.reduceat(hop_mask, self.hop_starts)
+
+
+class TripBatch(FlightBatch):
+
+    def __init__(self, trips: Iterable[Trip]):
+        self.trips = list(trips)
+        super().__init__([flight for trip in self.trips for flight in trip.flights])
+        counts = np.fromiter((len(t.flights) for t in self.trips), dtype=np.intp, count=len(self.trips))
+        self.trip_starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.intp)
+
+    def per_trip(self, flight_mask: np.ndarray) -> np.ndarray:
+        # A trip passes if all of its flights do
+        if len(self.trips) == 0:
+            return np.ones(0, dtype=bool)
+        return np.logical_and.reduceat(flight_mask, self.trip_starts)
+
+
+#
+
+
+def _seconds_of_day(d: datetime) -> float:
+    return d.hour * 3600 + d.minute * 60 + d.second + d.microsecond / 1e6
@@ -7,7 +7,7 @@ from typing import Iterable, Iterator
 import itertools
 
 from Data import SeatType
-from Data.FlightSearch import FlightSearch, SearchFilter, LegSearch, Passengers
+from Data.FlightSearch import FlightSearch, SearchFilter, LegSearch, Passengers, TripLimit
 
 
 class LegOptions(JSONModel):
@@ -62,6 +62,7 @@ class FlightOptions(JSONModel):
     currency: str
     filters: list[SearchFilter] = []
     seat: SeatType = SeatType.Economy
+    limit: TripLimit | None = None
 
     def __iter__(self) -> Iterator[FlightSearch]:
         return iter(self.build_searches())
@@ -73,4 +74,5 @@ class FlightOptions(JSONModel):
                                passengers=self.passengers,
                                filters=self.filters,
                                currency=self.currency,
-                               seat=self.seat)
+                               seat=self.seat,
+                               limit=self.limit)
@@ -4,10 +4,13 @@ from SprelfJSON import JSONModel, ModelElem
 
 from datetime import time, date
 from abc import ABC, abstractmethod
-from typing import Iterable
+from typing import Iterable, Sequence
+import heapq
+import numpy as np
 
 from Data.Enums import JourneyType, SeatType
-from Data.Flight import Flight
+from Data.Flight import Flight, Trip
+from Data.FlightBatch import FlightBatch, TripBatch
 
 
 #
@@ -45,6 +48,95 @@ class SearchFilter(JSONModel, ABC):
     def filter(self, flight: Flight) -> bool:
         ...
 
+    def filter_batch(self, batch: FlightBatch) -> np.ndarray:
+        # Override to evaluate a whole batch at once; must not modify the flights (see prune)
+        return np.fromiter((self.filter(f) for f in batch.flights), dtype=bool, count=len(batch))
+
+    def prune(self, batch: FlightBatch) -> bool:
+        # For filters whose filter() also narrows the tickets of the flights it keeps: does the same
+        # to the whole batch after filter_batch, and returns whether any tickets were dropped
+        return False
+
+    @classmethod
+    def mask(cls, filters: Sequence[SearchFilter], batch: FlightBatch) -> np.ndarray:
+        # Filters run in order, as filter() would, so the ones after a pruning filter see the pruned fares
+        mask = np.ones(len(batch), dtype=bool)
+        for f in filters:
+            if not isinstance(f, TripSearchFilter):
+                mask &= f.filter_batch(batch)
+                if f.prune(batch):
+                    batch.invalidate()
+        return mask
+
+    @classmethod
+    def filter_flights(cls, filters: Sequence[SearchFilter], flights: Iterable[Flight]) -> list[Flight]:
+        # Applies only the flight-level filters; meant for per-leg candidates before they're combined
+        batch = FlightBatch(flights)
+        if not any(not isinstance(f, TripSearchFilter) for f in filters):
+            return batch.flights
+        return [flight for flight, k in zip(batch.flights, cls.mask(filters, batch)) if k]
+
+    @classmethod
+    def filter_trips(cls, filters: Sequence[SearchFilter], trips: Iterable[Trip],
+                     trip_level_only: bool = False) -> list[Trip]:
+        batch = TripBatch(trips)
+        if len(filters) == 0:
+            return batch.trips
+        if trip_level_only:
+            keep = np.ones(len(batch.trips), dtype=bool)
+        else:
+            keep = batch.per_trip(cls.mask(filters, batch))
+        for f in filters:
+            if isinstance(f, TripSearchFilter):
+                keep &= f.mask_trips(batch)
+        return [trip for trip, k in zip(batch.trips, keep) if k]
+
+
+class TripSearchFilter(SearchFilter, ABC):
+    # Constraints on a combined trip rather than its individual flights.  These can't be applied to
+    # a leg's candidates, so they always run after collectors have combined flights into trips.
+
+    def filter(self, flight: Flight) -> bool:
+        return True
+
+    @abstractmethod
+    def filter_trip(self, trip: Trip) -> bool:
+        ...
+
+    def mask_trips(self, batch: TripBatch) -> np.ndarray:
+        # Override to evaluate a whole batch at once, like filter_batch
+        return np.fromiter((self.filter_trip(t) for t in batch.trips), dtype=bool, count=len(batch.trips))
+
+
+#
+
+
+class TripLimit(JSONModel):
+    top_k: int | None = None
+    max_cost: float | None = None
+    duration_weight: float = 0  # cost of each minute in the air or waiting, in the search currency
+
+    @property
+    def unbounded(self) -> bool:
+        return self.top_k is None and self.max_cost is None
+
+    def flight_cost(self, flight: Flight) -> float:
+        if self.duration_weight == 0:
+            return flight.cheapest()
+        return flight.cheapest() + self.duration_weight * flight.duration.total_seconds() / 60
+
+    def cost(self, trip: Trip) -> float:
+        return sum(self.flight_cost(f) for f in trip.flights)
+
+    def select(self, trips: Iterable[Trip]) -> list[Trip]:
+        # For collectors that get whole trips back; keeps the cheapest top_k under max_cost
+        costed = ((self.cost(t), i, t) for i, t in enumerate(trips))
+        if self.max_cost is not None:
+            costed = (c for c in costed if c[0] <= self.max_cost)
+        if self.top_k is not None:
+            return [t for _, _, t in heapq.nsmallest(self.top_k, costed)]
+        return [t for _, _, t in costed]
+
 
 #
 
@@ -56,6 +148,7 @@ class FlightSearch(JSONModel):
     currency: str
     seat: SeatType = SeatType.Economy
     filters: list[SearchFilter] = []
+    limit: TripLimit | None = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -108,6 +201,9 @@ class StopsSearchFilter(SearchFilter):
     def filter(self, flight: Flight) -> bool:
         return len(flight.layovers) <= self.stops
 
+    def filter_batch(self, batch: FlightBatch) -> np.ndarray:
+        return batch.stops <= self.stops
+
 
 class LuggageSearchFilter(SearchFilter):
     checked: int
@@ -121,6 +217,27 @@ class LuggageSearchFilter(SearchFilter):
                 return False
         return True
 
+    def filter_batch(self, batch: FlightBatch) -> np.ndarray:
+        hops, checked, carryon = batch.tickets
+        hop_ok = np.zeros(batch.hop_count, dtype=bool)
+        np.logical_or.at(hop_ok, hops, (checked >= self.checked) & (carryon >= self.carryon))
+        return batch.per_hop(hop_ok)
+
+    def prune(self, batch: FlightBatch) -> bool:
+        # Hops without a single fitting fare keep theirs; filter_batch has already dropped their flights
+        hops, checked, carryon = batch.tickets
+        fits = (checked >= self.checked) & (carryon >= self.carryon)
+        if fits.all():
+            return False
+        hop_ok = np.zeros(batch.hop_count, dtype=bool)
+        np.logical_or.at(hop_ok, hops, fits)
+        pruned = set(hops[~fits & hop_ok[hops]].tolist())
+        for i, hop in enumerate(h for f in batch.flights for h in f.hops):
+            if i in pruned:
+                hop.tickets = [t for t in hop.tickets
+                               if t.checked_bags >= self.checked and t.carryon_bags >= self.carryon]
+        return bool(pruned)
+
 
 class PriceSearchFilter(SearchFilter):
     max: float
@@ -132,6 +249,11 @@ class PriceSearchFilter(SearchFilter):
             raise ValueError(f"Currency mismatch: {self.currency} != {flight.currency}")
         return self.min <= sum(c.price for c in flight.cheapest_tickets()) <= self.max
 
+    def filter_batch(self, batch: FlightBatch) -> np.ndarray:
+        if len(batch) > 0 and (mismatched := batch.currency[batch.currency != self.currency]).size:
+            raise ValueError(f"Currency mismatch: {self.currency} != {mismatched[0]}")
+        return (self.min <= batch.cheapest) & (batch.cheapest <= self.max)
+
 
 class DepartureTimeSearchFilter(SearchFilter):
     min: time
@@ -140,6 +262,9 @@ class DepartureTimeSearchFilter(SearchFilter):
     def filter(self, flight: Flight) -> bool:
         return self.min <= flight.departure_time.time() <= self.max
 
+    def filter_batch(self, batch: FlightBatch) -> np.ndarray:
+        return (_seconds(self.min) <= batch.departure_of_day) & (batch.departure_of_day <= _seconds(self.max))
+
 
 class ArrivalTimeSearchFilter(SearchFilter):
     min: time
@@ -148,6 +273,9 @@ class ArrivalTimeSearchFilter(SearchFilter):
     def filter(self, flight: Flight) -> bool:
         return self.min <= flight.arrival_time.time() <= self.max
 
+    def filter_batch(self, batch: FlightBatch) -> np.ndarray:
+        return (_seconds(self.min) <= batch.arrival_of_day) & (batch.arrival_of_day <= _seconds(self.max))
+
 
 class DurationSearchFilter(SearchFilter):
     max: int  # minutes
@@ -155,3 +283,37 @@ class DurationSearchFilter(SearchFilter):
 
     def filter(self, flight: Flight) -> bool:
         return self.min <= flight.duration.total_seconds() // 60 <= self.max
+
+    def filter_batch(self, batch: FlightBatch) -> np.ndarray:
+        minutes = batch.duration // 60
+        return (self.min <= minutes) & (minutes <= self.max)
+
+
+class StaySearchFilter(TripSearchFilter):
+    # Time between arriving on one flight of a trip and leaving on the next
+    max: int | None = None  # hours
+    min: int = 0  # hours
+
+    def filter_trip(self, trip: Trip) -> bool:
+        return all(self._allowed((nxt.departure_time - prev.arrival_time).total_seconds() / 3600)
+                   for prev, nxt in zip(trip.flights, trip.flights[1:]))
+
+    def mask_trips(self, batch: TripBatch) -> np.ndarray:
+        if len(batch.trips) == 0:
+            return np.ones(0, dtype=bool)
+        # Stay before each flight; the first flight of a trip has none
+        hours = np.zeros(len(batch), dtype=float)
+        hours[1:] = (batch.departure[1:] - batch.arrival[:-1]) / 3600
+        ok = self._allowed(hours)
+        ok[batch.trip_starts] = True
+        return np.logical_and.reduceat(ok, batch.trip_starts)
+
+    def _allowed(self, hours):
+        return (self.min <= hours) & (hours <= (np.inf if self.max is None else self.max))
+
+
+#
+
+
+def _seconds(t: time) -> float:
+    return t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1e6
@@ -1,5 +1,7 @@
 from Data.Enums import JourneyType, SeatType
 from Data.Flight import Flight, Layover, Ticket, Hop, Trip
-from Data.FlightSearch import FlightSearch, SearchFilter, LegSearch, Passengers, LuggageSearchFilter, \
-    PriceSearchFilter, StopsSearchFilter, DurationSearchFilter, ArrivalTimeSearchFilter
+from Data.FlightBatch import FlightBatch, TripBatch
+from Data.FlightSearch import FlightSearch, SearchFilter, TripSearchFilter, LegSearch, Passengers, LuggageSearchFilter, \
+    PriceSearchFilter, StopsSearchFilter, DurationSearchFilter, ArrivalTimeSearchFilter, \
+    DepartureTimeSearchFilter, StaySearchFilter, TripLimit
 from Data.FlightOptions import FlightOptions, LegOptions
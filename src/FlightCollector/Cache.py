@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+from SprelfJSON import JSONModel
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from enum import Enum
+from typing import Any, Callable, Awaitable, Iterable, Iterator, TypeVar
+import asyncio
+import threading
+import sqlite3
+import pickle
+import time
+import os
+
+from Data import Passengers
+from FlightCollector.Metrics import Metrics
+
+T = TypeVar("T")
+_MISSING = object()
+
+
+#
+
+
+class TTLTier(JSONModel):
+    days: int  # applies to departures at most this many days away
+    hours: float
+
+
+class TTLPolicy(JSONModel):
+    tiers: list[TTLTier] = [TTLTier(days=3, hours=3),
+                            TTLTier(days=14, hours=12),
+                            TTLTier(days=60, hours=48)]
+    default_hours: float = 168
+
+    def ttl(self, departure: date | None, now: datetime | None = None) -> timedelta:
+        if departure is None:
+            return timedelta(hours=self.default_hours)
+        days = (departure - (now or datetime.now()).date()).days
+        for tier in sorted(self.tiers, key=lambda t: t.days):
+            if days <= tier.days:
+                return timedelta(hours=tier.hours)
+        return timedelta(hours=self.default_hours)
+
+
+#
+
+
+class FetchCache(ABC):
+    # Caches whose reads and writes can block (on disk, or on another process's lock); async fetches
+    # run those on a worker thread so they don't hold up the event loop
+    BLOCKING: bool = False
+
+    def __init__(self, policy: TTLPolicy | None = None):
+        self.policy = policy or TTLPolicy()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        def _norm(p: Any) -> str:
+            if isinstance(p, Enum):
+                return p.name
+            if isinstance(p, (date, datetime)):
+                return p.isoformat()
+            if isinstance(p, Passengers):
+                return f"{p.adults},{p.children},{p.infants_in_seat},{p.infants_on_lap}"
+            if isinstance(p, (tuple, list)):
+                return "(" + ",".join(_norm(x) for x in p) + ")"
+            return str(p).upper() if isinstance(p, str) else str(p)
+        return "|".join(_norm(p) for p in parts)
+
+    def fetch(self, key: str, departure: date | None, producer: Callable[[], T], fresh: bool = False) -> T:
+        # With `fresh` the cached value (if any) is ignored and replaced by a new one
+        value = _MISSING if fresh else self.get(key)
+        if value is not _MISSING:
+            return value
+        value = producer()
+        self.put(key, value, self.policy.ttl(departure))
+        return value
+
+    async def fetch_async(self, key: str, departure: date | None, producer: Callable[[], Awaitable[T]],
+                          fresh: bool = False) -> T:
+        if fresh:
+            value = _MISSING
+        else:
+            value = await asyncio.to_thread(self.get, key) if self.BLOCKING else self.get(key)
+        if value is not _MISSING:
+            return value
+        value = await producer()
+        if self.BLOCKING:
+            await asyncio.to_thread(self.put, key, value, self.policy.ttl(departure))
+        else:
+            self.put(key, value, self.policy.ttl(departure))
+        return value
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            value = self._get(key)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        Metrics.count("cache.miss" if value is _MISSING else "cache.hit")
+        return value
+
+    def contains(self, key: str) -> bool:
+        # Whether `key` would be served from the cache, without counting it as a hit or miss
+        with self._lock:
+            return self._contains(key)
+
+    def put(self, key: str, value: Any, ttl: timedelta):
+        with self._lock:
+            self._put(key, value, time.time() + ttl.total_seconds())
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self)}
+
+    @abstractmethod
+    def _get(self, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    def _put(self, key: str, value: Any, expires: float):
+        ...
+
+    @abstractmethod
+    def _contains(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+#
+
+
+class MemoryCache(FetchCache):
+
+    def __init__(self, max_entries: int = 1024, policy: TTLPolicy | None = None):
+        super().__init__(policy)
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def _get(self, key: str) -> Any:
+        if (entry := self._entries.get(key)) is None:
+            return _MISSING
+        expires, value = entry
+        if expires < time.time():
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _contains(self, key: str) -> bool:
+        return (entry := self._entries.get(key)) is not None and entry[0] >= time.time()
+
+    def _put(self, key: str, value: Any, expires: float):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache(FetchCache):
+    BLOCKING: bool = True
+
+    def __init__(self, path: str, max_entries: int = 20000, max_bytes: int = 512 * 1024 * 1024,
+                 policy: TTLPolicy | None = None):
+        super().__init__(policy)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, accessed REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+            self._conn.commit()
+        return self._conn
+
+    def _get(self, key: str) -> Any:
+        row = self.conn.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return _MISSING
+        value, expires = row
+        now = time.time()
+        if expires < now:
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.conn.commit()
+            return _MISSING
+        self.conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        return pickle.loads(value)
+
+    def _contains(self, key: str) -> bool:
+        row = self.conn.execute("SELECT expires FROM entries WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] >= time.time()
+
+    def _put(self, key: str, value: Any, expires: float):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        self.conn.execute("INSERT OR REPLACE INTO entries (key, value, size, expires, accessed) "
+                          "VALUES (?, ?, ?, ?, ?)", (key, blob, len(blob), expires, now))
+        self._evict(now)
+        self.conn.commit()
+
+    def _evict(self, now: float):
+        self.conn.execute("DELETE FROM entries WHERE expires < ?", (now,))
+        count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+        evicted = 0
+        for key, entry_size in self.conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            count -= 1
+            size -= entry_size
+            evicted += 1
+        self.evictions += evicted
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+#
+
+
+class FetchMemo:
+    # Run-scoped, in-memory record of every fetch made while it's active, so a key requested by
+    # many searches (or concurrently by several workers) is only fetched once.  Failures are kept
+    # too, and re-raised to every later caller instead of being retried.  Keys in `bypass` skip the
+    # collectors' caches, and `provided` collects the keys that were fetched from the provider.
+    active: FetchMemo | None = None
+
+    def __init__(self, bypass: Iterable[str] = ()):
+        self._futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.reused = 0
+        self.bypass = frozenset(bypass)
+        self.provided: set[str] = set()
+
+    @classmethod
+    @contextmanager
+    def activate(cls, bypass: Iterable[str] = ()) -> Iterator[FetchMemo]:
+        previous, cls.active = cls.active, FetchMemo(bypass)
+        try:
+            yield cls.active
+        finally:
+            cls.active = previous
+
+    def _claim(self, key: str) -> tuple[Future, bool]:
+        with self._lock:
+            if (future := self._futures.get(key)) is not None:
+                self.reused += 1
+                owner = False
+            else:
+                future = self._futures[key] = Future()
+                self.fetched += 1
+                owner = True
+        Metrics.count("memo.fetched" if owner else "memo.reused")
+        return future, owner
+
+    def record_provided(self, key: str):
+        with self._lock:
+            self.provided.add(key)
+
+    def fetch(self, key: str, producer: Callable[[], T]) -> T:
+        future, owner = self._claim(key)
+        if owner:
+            try:
+                future.set_result(producer())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    async def fetch_async(self, key: str, producer: Callable[[], Awaitable[T]]) -> T:
+        future, owner = self._claim(key)
+        if owner:
+            try:
+                future.set_result(await producer())
+            except BaseException as e:
+                future.set_exception(e)
+        return await asyncio.wrap_future(future)
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from typing import Iterator, Sequence
+import itertools
+import heapq
+
+from Data import Flight, TripLimit
+
+
+#
+
+
+def combine_legs(flight_lists: Sequence[Sequence[Flight]], limit: TripLimit | None = None) \
+        -> Iterator[tuple[Flight, ...]]:
+    # Yields one flight per leg.  Without a limit this is the full cartesian product; with one,
+    # combinations come out cheapest first and enumeration stops as soon as the next one can't
+    # make the top-K or goes over the cost bound, so losing combinations are never built.
+    if limit is None or limit.unbounded:
+        yield from itertools.product(*flight_lists)
+        return
+    if any(len(flights) == 0 for flights in flight_lists) or limit.top_k == 0:
+        return
+
+    legs: list[list[tuple[float, Flight]]] = [sorted(((limit.flight_cost(f), f) for f in flights),
+                                                     key=lambda x: x[0])
+                                              for flights in flight_lists]
+
+    # Best-first over index vectors.  Each vector is reached from exactly one parent (the one
+    # with its last advanced coordinate stepped back), and since every leg is sorted a child never
+    # costs less than its parent, so vectors pop in non-decreasing cost order.
+    start = (0,) * len(legs)
+    heap: list[tuple[float, tuple[int, ...], int]] = [(sum(leg[0][0] for leg in legs), start, 0)]
+    produced = 0
+    while heap:
+        cost, idx, last = heapq.heappop(heap)
+        if limit.max_cost is not None and cost > limit.max_cost:
+            return
+        yield tuple(leg[i][1] for leg, i in zip(legs, idx))
+        produced += 1
+        if limit.top_k is not None and produced >= limit.top_k:
+            return
+        for j in range(last, len(legs)):
+            if idx[j] + 1 < len(legs[j]):
+                child = idx[:j] + (idx[j] + 1,) + idx[j + 1:]
+                heapq.heappush(heap, (sum(leg[i][0] for leg, i in zip(legs, child)), child, j))
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+from concurrent.futures import Future
+from typing import Any, Coroutine, TypeVar
+import threading
+import asyncio
+import atexit
+
+T = TypeVar("T")
+
+
+#
+
+
+class BackgroundLoop:
+    # An asyncio loop running on its own daemon thread, so synchronous code (collectors running on
+    # worker threads) can share long-lived async resources such as browsers and HTTP clients.
+    _shared: BackgroundLoop | None = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, name: str = "flights-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def shared(cls) -> BackgroundLoop:
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared.closed:
+                cls._shared = BackgroundLoop()
+                atexit.register(cls._shared.close)
+            return cls._shared
+
+    @property
+    def closed(self) -> bool:
+        return self.loop.is_closed() or not self._thread.is_alive()
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> Future[T]:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("BackgroundLoop.run() cannot be called from the loop's own thread")
+        return self.submit(coro).result(timeout)
+
+    def close(self):
+        if self.closed:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        if not self.loop.is_running():
+            self.loop.close()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
@@ -1,21 +1,41 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Iterable, Self
+from typing import Iterable, AsyncIterator, Self, Callable, Awaitable, TypeVar, NamedTuple, Any
+from datetime import date
 from types import TracebackType
 import pathlib
 import os
 
 from Data import Flight, FlightSearch, Trip
+from FlightCollector.Cache import FetchCache, DiskCache, FetchMemo
+from FlightCollector.Metrics import Metrics
+from FlightCollector.Replay import Tape
 
 
 _HOME = str(pathlib.Path.home())
+T = TypeVar("T")
+
+#
+
+
+class FetchUnit(NamedTuple):
+    # One provider request that one or more searches depend on
+    collector: type[FlightCollector]
+    key: str
+    departure: date | None
+    args: Any
+
 
 #
 
 
 class FlightCollector(ABC):
     _CONFIG_FILE: str = os.path.join(_HOME, ".flights/config.toml")
+    MAX_CONCURRENCY: int = 1
+    # Whether collect() already drops flights failing the search's flight-level filters
+    FILTERS_FLIGHTS: bool = False
+    CACHE: FetchCache | None = DiskCache(os.path.join(_HOME, ".flights/cache.sqlite"))
 
     def initialize(self):
         ...
@@ -37,9 +57,114 @@ class FlightCollector(ABC):
     def collect(self, search: FlightSearch) -> Iterable[Trip]:
         ...
 
+    @classmethod
+    def fetch_units(cls, search: FlightSearch) -> list[FetchUnit]:
+        # The provider requests `collect(search)` will make; collectors that can't say return none,
+        # the ones that can are FetchUnitCollectors
+        return []
+
+    @classmethod
+    def _cached(cls, key: str, departure: date | None, fetch: Callable[[], T]) -> T:
+        memo = FetchMemo.active
+
+        def _timed() -> T:
+            with Metrics.timed(f"{cls.__name__}.fetch", key=key):
+                value = fetch()
+            if memo is not None:
+                memo.record_provided(key)
+            return value
+
+        def _fetch() -> T:
+            if cls.CACHE is None:
+                return _timed()
+            return cls.CACHE.fetch(key, departure, _timed, fresh=memo is not None and key in memo.bypass)
+
+        if memo is None:
+            return _fetch()
+        return memo.fetch(key, _fetch)
+
+    @classmethod
+    def set_concurrency(cls, limit: int):
+        # Called before a run that may have up to `limit` of this collector's requests in flight at
+        # once (MAX_CONCURRENCY unless the plan overrides it), for collectors that size pools by it
+        ...
+
+    @classmethod
+    def is_cached(cls, key: str) -> bool:
+        # Whether `key` would be served from the cache, which it isn't while the active memo bypasses it
+        if FetchMemo.active is not None and key in FetchMemo.active.bypass:
+            return False
+        return cls.CACHE is not None and cls.CACHE.contains(key)
+
+    @classmethod
+    def _raw(cls, key: str, fetch: Callable[[], T]) -> T:
+        # Every raw provider response passes through here, so an active Tape can record or replay it
+        if Tape.active is None:
+            return fetch()
+        return Tape.active.fetch(cls, key, fetch)
+
     @classmethod
     @abstractmethod
     def is_allowed(cls, search: FlightSearch) -> bool:
         ...
 
 
+class FetchUnitCollector(FlightCollector, ABC):
+    # Collectors that declare the provider requests behind each search, so a SearchPlan can run
+    # every distinct one once up front.  `fetch_unit` makes one of them through the collector's
+    # cache (a coroutine on async collectors), leaving the result where `collect` will find it.
+
+    @classmethod
+    @abstractmethod
+    def fetch_units(cls, search: FlightSearch) -> list[FetchUnit]:
+        ...
+
+    @abstractmethod
+    def fetch_unit(self, unit: FetchUnit):
+        ...
+
+
+class AsyncFlightCollector(FlightCollector, ABC):
+    # Collectors whose `collect` is an async generator.  SearchPlan runs these on the shared
+    # background event loop instead of a worker thread.
+
+    async def __aenter__(self) -> Self:
+        self.initialize()
+        return self
+
+    async def __aexit__(self, exc_type: type[BaseException] | None,
+                        exc_val: BaseException | None,
+                        exc_tb: TracebackType | None) -> bool:
+        self.close()
+        return False
+
+    @abstractmethod
+    def collect(self, search: FlightSearch) -> AsyncIterator[Trip]:
+        ...
+
+    @classmethod
+    async def _cached_async(cls, key: str, departure: date | None, fetch: Callable[[], Awaitable[T]]) -> T:
+        memo = FetchMemo.active
+
+        async def _timed() -> T:
+            with Metrics.timed(f"{cls.__name__}.fetch", key=key):
+                value = await fetch()
+            if memo is not None:
+                memo.record_provided(key)
+            return value
+
+        async def _fetch() -> T:
+            if cls.CACHE is None:
+                return await _timed()
+            return await cls.CACHE.fetch_async(key, departure, _timed,
+                                               fresh=memo is not None and key in memo.bypass)
+
+        if memo is None:
+            return await _fetch()
+        return await memo.fetch_async(key, _fetch)
+
+    @classmethod
+    async def _raw_async(cls, key: str, fetch: Callable[[], Awaitable[T]]) -> T:
+        if Tape.active is None:
+            return await fetch()
+        return await Tape.active.fetch_async(cls, key, fetch)
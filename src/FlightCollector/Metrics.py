@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from typing import Any, Iterator, ContextManager
+import tracemalloc
+import threading
+import time
+import json
+import os
+
+
+#
+
+
+class MetricsHook:
+    # Sees every span and counter as it happens, e.g. to forward them to an external profiler.
+    # Hooks are called on whichever thread (or the background event loop) did the work.
+
+    def span_started(self, name: str, tags: dict[str, Any]):
+        ...
+
+    def span_finished(self, name: str, tags: dict[str, Any], seconds: float):
+        ...
+
+    def counted(self, name: str, n: int):
+        ...
+
+    def gauged(self, name: str, value: float):
+        ...
+
+
+class SpanStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_json(self) -> dict[str, float]:
+        return {"count": self.count, "total_seconds": self.total, "max_seconds": self.max,
+                "mean_seconds": self.total / self.count if self.count else 0.0}
+
+
+#
+
+
+class Metrics:
+    # Run-scoped timings and counters.  Instrumented code reports through the classmethods, which
+    # do nothing unless a Metrics is active, so collectors and rankers can be used without one.
+    active: Metrics | None = None
+    MAX_ERRORS: int = 100
+
+    def __init__(self, trace_memory: bool = False, hooks: list[MetricsHook] | None = None):
+        self.trace_memory = trace_memory
+        self.hooks = list(hooks or [])
+        self.started = datetime.now(timezone.utc)
+        self.spans: dict[str, SpanStats] = {}
+        self.counters: Counter[str] = Counter()
+        self.gauges: dict[str, dict[str, float]] = {}  # last, min and max of values that go up and down
+        self.queries: list[dict[str, Any]] = []
+        self.errors: list[dict[str, Any]] = []
+        self.memory: dict[str, dict[str, int]] = {}
+        self._start = time.perf_counter()
+        self._seconds: float | None = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    @contextmanager
+    def activate(cls, trace_memory: bool = False, hooks: list[MetricsHook] | None = None) -> Iterator[Metrics]:
+        previous, cls.active = cls.active, Metrics(trace_memory=trace_memory, hooks=hooks)
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            yield cls.active
+        finally:
+            cls.active.snapshot("end")
+            cls.active._seconds = time.perf_counter() - cls.active._start
+            if started_tracing:
+                tracemalloc.stop()
+            cls.active = previous
+
+    #
+
+    @classmethod
+    def timed(cls, name: str, **tags: Any) -> ContextManager:
+        if cls.active is None:
+            return nullcontext()
+        return cls.active._span(name, tags)
+
+    @classmethod
+    def count(cls, name: str, n: int = 1):
+        if cls.active is not None:
+            cls.active._add(name, n)
+
+    @classmethod
+    def gauge(cls, name: str, value: float):
+        if cls.active is not None:
+            cls.active._set(name, value)
+
+    @classmethod
+    def error(cls, source: str, e: BaseException, **tags: Any):
+        if cls.active is not None:
+            cls.active._error(source, e, tags)
+
+    @classmethod
+    def query(cls, **record: Any):
+        if cls.active is not None:
+            with cls.active._lock:
+                cls.active.queries.append(record)
+
+    @classmethod
+    def snapshot(cls, label: str):
+        # Current and peak traced memory since the previous snapshot
+        if cls.active is not None and cls.active.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            with cls.active._lock:
+                cls.active.memory[label] = {"current_bytes": current, "peak_bytes": peak}
+
+    #
+
+    @contextmanager
+    def _span(self, name: str, tags: dict[str, Any]) -> Iterator[None]:
+        for hook in self.hooks:
+            hook.span_started(name, tags)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                if (stats := self.spans.get(name)) is None:
+                    stats = self.spans[name] = SpanStats()
+                stats.add(seconds)
+            for hook in self.hooks:
+                hook.span_finished(name, tags, seconds)
+
+    def _add(self, name: str, n: int):
+        with self._lock:
+            self.counters[name] += n
+        for hook in self.hooks:
+            hook.counted(name, n)
+
+    def _set(self, name: str, value: float):
+        with self._lock:
+            if (g := self.gauges.get(name)) is None:
+                self.gauges[name] = {"last": value, "min": value, "max": value}
+            else:
+                g["last"], g["min"], g["max"] = value, min(g["min"], value), max(g["max"], value)
+        for hook in self.hooks:
+            hook.gauged(name, value)
+
+    def _error(self, source: str, e: BaseException, tags: dict[str, Any]):
+        with self._lock:
+            if len(self.errors) < self.MAX_ERRORS:
+                self.errors.append({"source": source, "type": type(e).__name__, "message": str(e)[:500],
+                                    **{k: str(v) for k, v in tags.items()}})
+        self._add(f"errors.{source}", 1)
+
+    @property
+    def seconds(self) -> float:
+        return self._seconds if self._seconds is not None else time.perf_counter() - self._start
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            return {"started": self.started.isoformat(),
+                    "seconds": self.seconds,
+                    "spans": {name: s.to_json() for name, s in sorted(self.spans.items())},
+                    "counters": dict(sorted(self.counters.items())),
+                    "gauges": {name: dict(g) for name, g in sorted(self.gauges.items())},
+                    "memory": dict(self.memory),
+                    "errors": list(self.errors),
+                    "queries": list(self.queries)}
+
+    def write(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        os.replace(tmp, path)
+
+    def __str__(self) -> str:
+        lines = [f"{'span':>40} {'count':>7} {'total s':>9} {'max s':>8}"]
+        for name, s in sorted(self.spans.items(), key=lambda x: -x[1].total):
+            lines.append(f"{name:>40} {s.count:7d} {s.total:9.2f} {s.max:8.2f}")
+        lines.extend(f"{name:>40} {n:7d}" for name, n in sorted(self.counters.items()))
+        lines.extend(f"{name:>40} {g['last']:7.2f} (min {g['min']:.2f}, max {g['max']:.2f})"
+                     for name, g in sorted(self.gauges.items()))
+        return "\n".join(lines)
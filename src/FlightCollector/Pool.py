@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from contextlib import contextmanager, asynccontextmanager
+from typing import Iterator, AsyncIterator, TypeVar
+import threading
+
+from FlightCollector.FlightCollector import FlightCollector, AsyncFlightCollector
+from FlightCollector.Metrics import Metrics
+
+C = TypeVar("C", bound=FlightCollector)
+
+
+#
+
+
+class CollectorPool:
+    # Initialized collectors kept for reuse, so config is read and connections are set up once per
+    # worker instead of once per query.  Each instance is leased to one caller at a time and goes
+    # back to the idle list afterwards; close() closes them all.  While a pool is active every
+    # lease comes from it, and without one a lease is a fresh instance closed straight after use.
+    active: CollectorPool | None = None
+
+    def __init__(self):
+        self._idle: dict[type[FlightCollector], list[FlightCollector]] = {}
+        self._leased = 0
+        self._lock = threading.Lock()
+        self.closed = False
+
+    @classmethod
+    @contextmanager
+    def activate(cls) -> Iterator[CollectorPool]:
+        # Joins the active pool if there is one, so a long-lived process can keep a single pool
+        # across runs; only the outermost activation closes it
+        if cls.active is not None:
+            yield cls.active
+            return
+        cls.active = CollectorPool()
+        try:
+            yield cls.active
+        finally:
+            pool, cls.active = cls.active, None
+            pool.close()
+
+    @classmethod
+    @contextmanager
+    def lease(cls, collector: type[C]) -> Iterator[C]:
+        if cls.active is None:
+            with collector() as instance:
+                yield instance
+            return
+        pool = cls.active
+        instance = pool._take(collector)
+        try:
+            yield instance
+        finally:
+            pool._give(instance)
+
+    @classmethod
+    @asynccontextmanager
+    async def lease_async(cls, collector: type[AsyncFlightCollector]) -> AsyncIterator[AsyncFlightCollector]:
+        if cls.active is None:
+            async with collector() as instance:
+                yield instance
+            return
+        pool = cls.active
+        instance = pool._take(collector)
+        try:
+            yield instance
+        finally:
+            pool._give(instance)
+
+    #
+
+    def _take(self, collector: type[C]) -> C:
+        with self._lock:
+            idle = self._idle.get(collector)
+            instance = idle.pop() if idle else None
+            self._leased += 1
+        if instance is not None:
+            Metrics.count("collectors.reused")
+            return instance
+        try:
+            instance = collector()
+            instance.initialize()
+        except BaseException:
+            with self._lock:
+                self._leased -= 1
+            raise
+        Metrics.count("collectors.initialized")
+        return instance
+
+    def _give(self, instance: FlightCollector):
+        with self._lock:
+            self._leased -= 1
+            if not self.closed:
+                self._idle.setdefault(type(instance), []).append(instance)
+                return
+        self._close(instance)
+
+    def close(self):
+        # Closes the idle instances; anything still leased out is closed when it's given back
+        with self._lock:
+            self.closed = True
+            instances = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for instance in instances:
+            self._close(instance)
+
+    @classmethod
+    def _close(cls, instance: FlightCollector):
+        try:
+            instance.close()
+        except Exception as e:
+            Metrics.error(type(instance).__name__, e)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values()) + self._leased
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+from playwright.async_api import async_playwright, Playwright, Browser, BrowserContext, Page, \
+    TimeoutError as PlaywrightTimeoutError
+import threading
+import asyncio
+import atexit
+
+from FlightCollector.EventLoop import BackgroundLoop
+from FlightCollector.Metrics import Metrics
+
+
+#
+
+
+class BrowserPool:
+    # A single long-lived Chromium with one shared context (so the consent cookie survives between
+    # fetches) and up to `size` pages that are handed out to fetches and recycled after `max_uses`.
+    # If Chromium or the context goes away, the next fetch launches a new one; the same happens when
+    # the event loop it was started on has been replaced.
+    CONSENT_URL = "https://consent.google.com"
+    # True once the page shows either a results list or Google's no-results message
+    SETTLED_SCRIPT = """() => {
+        const main = document.querySelector('[role="main"]');
+        return main !== null && (main.querySelector('ul.Rk10dc li') !== null ||
+                                 /no (results|flights) (returned|found)/i.test(main.innerText));
+    }"""
+    MAIN_SCRIPT = "() => document.querySelector('[role=\"main\"]').innerHTML"
+    READ_ATTEMPTS = 5
+
+    _shared: BrowserPool | None = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, size: int = 2, headless: bool = True, max_uses: int = 25, timeout: float = 30,
+                 settle_timeout: float = 5, loop: BackgroundLoop | None = None):
+        self.size = max(1, size)
+        self.headless = headless
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self.settle_timeout = settle_timeout
+        self._loop = loop
+        self._bound: BackgroundLoop | None = None  # the loop the browser below was started on
+        self._bound_lock = threading.Lock()
+        self._playwright: Playwright | None = None
+        self._browser: Browser | None = None
+        self._context: BrowserContext | None = None
+        self._idle: list[tuple[Page, int]] = []
+        self._slots: asyncio.Semaphore | None = None
+        self._start_lock: asyncio.Lock | None = None
+
+    @classmethod
+    def shared(cls, size: int = 2, headless: bool = True) -> BrowserPool:
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = BrowserPool(size=size, headless=headless)
+                atexit.register(cls._shared.close)
+            elif (size, headless) != (cls._shared.size, cls._shared.headless):
+                print(f"The shared browser pool already runs with size={cls._shared.size}, "
+                      f"headless={cls._shared.headless}; ignoring size={size}, headless={headless}")
+            return cls._shared
+
+    @property
+    def loop(self) -> BackgroundLoop:
+        # Looked up on every use, so the pool follows the shared loop when that is recreated
+        return self._loop or BackgroundLoop.shared()
+
+    def fetch(self, url: str) -> str:
+        loop = self.loop
+        with self._bound_lock:
+            if loop is not self._bound:
+                # Anything started on the previous loop can't be used (or closed) from this one
+                self._forget()
+                self._bound = loop
+        return loop.run(self._fetch(url))
+
+    def close(self):
+        with self._bound_lock:
+            loop = self._bound
+        if loop is not None and not loop.closed:
+            loop.run(self._close())
+
+    #
+
+    async def _fetch(self, url: str) -> str:
+        await self._start()
+        with Metrics.timed("BrowserPool.page_wait"):
+            page, uses = await self._acquire()
+        try:
+            with Metrics.timed("BrowserPool.load"):
+                body = await self._load(page, url)
+        except Exception:
+            Metrics.count("BrowserPool.load_failures")
+            await self._discard(page)
+            raise
+        await self._release(page, uses + 1)
+        return body
+
+    async def _load(self, page: Page, url: str) -> str:
+        timeout_ms = self.timeout * 1000
+        await page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
+        if page.url.startswith(self.CONSENT_URL):
+            await page.click('text="Accept all"', timeout=timeout_ms)
+            await page.wait_for_url("https://www.google.com/**", timeout=timeout_ms)
+        try:
+            await page.wait_for_function(self.SETTLED_SCRIPT, polling=250, timeout=self.settle_timeout * 1000)
+        except PlaywrightTimeoutError:
+            # Neither showed up in time; take whatever is there, as an empty page parses to no flights
+            Metrics.count("BrowserPool.settle_timeouts")
+        error: Exception | None = None
+        for _ in range(self.READ_ATTEMPTS):
+            try:
+                return await page.evaluate(self.MAIN_SCRIPT)
+            except Exception as e:
+                # Usually the main element isn't there yet
+                error = e
+                await asyncio.sleep(1)
+        raise RuntimeError(f"Could not read the results page at {page.url}") from error
+
+    async def _start(self):
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._context is not None:
+                return
+            if self._playwright is not None:
+                # What's left of a browser that went away
+                Metrics.count("BrowserPool.relaunches")
+                await self._close()
+            with Metrics.timed("BrowserPool.launch"):
+                self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=self.headless)
+                context = await self._browser.new_context(locale="en-US")
+            self._browser.on("disconnected", lambda _: self._lost(context))
+            context.on("close", lambda _: self._lost(context))
+            self._context = context
+            self._idle = []
+            if self._slots is None:
+                # Kept across relaunches, as pages still out on the old browser give their slot back
+                self._slots = asyncio.Semaphore(self.size)
+
+    def _lost(self, context: BrowserContext):
+        # The browser or its context closed without close() being called; _start launches a new one
+        if self._context is context:
+            Metrics.count("BrowserPool.lost")
+            self._context = None
+            self._idle = []
+
+    def _forget(self):
+        self._playwright = self._browser = self._context = None
+        self._idle = []
+        self._slots = self._start_lock = None
+
+    async def _acquire(self) -> tuple[Page, int]:
+        await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+        try:
+            Metrics.count("BrowserPool.pages_opened")
+            return await self._context.new_page(), 0
+        except Exception:
+            self._slots.release()
+            raise
+
+    async def _release(self, page: Page, uses: int):
+        if uses >= self.max_uses or page.context is not self._context:
+            await self._discard(page)
+            return
+        self._idle.append((page, uses))
+        self._slots.release()
+
+    async def _discard(self, page: Page):
+        self._slots.release()
+        try:
+            await page.close()
+        except Exception:
+            pass
+
+    async def _close(self):
+        playwright, browser, context = self._playwright, self._browser, self._context
+        self._playwright = self._browser = self._context = None
+        self._idle = []
+        for close in (context and context.close, browser and browser.close, playwright and playwright.stop):
+            if close is not None:
+                try:
+                    await close()
+                except Exception:
+                    # Already gone along with the browser
+                    pass
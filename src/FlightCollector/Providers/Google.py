@@ -1,32 +1,34 @@
 from __future__ import annotations
 
-from typing import Iterable, Literal, Any, Callable
-import fast_flights.core
-from fast_flights import FlightData, Passengers as FFPassengers, Result, get_flights
-from selectolax.lexbor import LexborHTMLParser, LexborNode
-from fast_flights.primp import Response
-from datetime import datetime, timedelta, timezone, tzinfo
-import itertools
+from typing import Iterable, Iterator, Literal
+from fast_flights import FlightData, Passengers as FFPassengers
+from fast_flights.filter import TFSData
+from selectolax.lexbor import LexborHTMLParser, LexborNode, LexborCSSSelector
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
 import functools
-import airporttime
+import threading
 import re
-import asyncio
-import pytz
-from playwright.async_api import async_playwright
-import fast_flights.local_playwright
 
-from Data import Flight, FlightSearch, JourneyType, SeatType, Trip, Hop, Ticket, Passengers, LegSearch
-from FlightCollector.FlightCollector import FlightCollector
+from Data import Flight, FlightSearch, JourneyType, SeatType, Trip, Hop, Ticket, Passengers, LegSearch, SearchFilter
+from FlightCollector.FlightCollector import FetchUnitCollector, FetchUnit
+from FlightCollector.Cache import FetchCache
+from FlightCollector.Enumeration import combine_legs
+from FlightCollector.Providers.Browser import BrowserPool
+from FlightCollector.Timezones import TimezoneIndex
+from FlightCollector.Metrics import Metrics
 
+SEARCH_URL = "https://www.google.com/travel/flights"
 DATE_FORMAT = "%I:%M %p on %a, %b %d"
-DURATION_FORMAT = re.compile(r"(\d+) hr( (\d+) min)?")
-LAYOVER_RE = re.compile(r"((\d+) ?hr ?((\d+) ?min)? ?)?([A-Z]{3})")
+DURATION_FORMAT = re.compile(r"(?:(\d+) ?hr)? ?(?:(\d+) ?min)?")
+LAYOVER_RE = re.compile(r"((?:\d+ ?hr)? ?(?:\d+ ?min)? ?)([A-Z]{3})")
 today = datetime.today()
 
 
 #
 
 
+@functools.lru_cache(maxsize=4096)
 def _parse_date(date: str) -> datetime:
     if date.index(":") == 1:
         date = "0" + date
@@ -38,69 +40,75 @@ def _parse_date(date: str) -> datetime:
     return parsed
 
 
+@functools.lru_cache(maxsize=1024)
 def _parse_duration(duration: str) -> timedelta:
     try:
         if m := DURATION_FORMAT.match(duration):
-            return timedelta(hours=int(m.group(1)), minutes=int(m.group(3)) if m.group(2) else 0)
+            return timedelta(hours=int(m.group(1) or 0), minutes=int(m.group(2) or 0))
     except TypeError:
         pass
     return timedelta(0)
 
 
-def _parse_dates(date_start: str, date_end: str, duration: str,
-                 origin: str, destination: str) -> tuple[datetime, datetime]:
+def _parse_dates(date_start: str, date_end: str, origin: str, destination: str) -> tuple[datetime, datetime]:
     d1, d2 = _parse_date(date_start), _parse_date(date_end)
-    # m = DURATION_FORMAT.match(duration)
-    # duration = timedelta(hours=int(m.group(1)), minutes=int(m.group(3)) if m.group(2) else 0)
-    # delta = d2 - d1
-    # offset = round((delta - duration).total_seconds() / 3600)
-    def _parse(d: datetime, loc: str) -> datetime:
-        if loc == "PKX":
-            tz = pytz.timezone("Asia/Shanghai")
-            return d.replace(tzinfo=tz)
-        try:
-            apt = airporttime.AirportTime(iata_code=loc)
-            return apt.from_utc(apt.to_utc(d))
-        except TypeError:
-            return d
-
-    return _parse(d1, origin), _parse(d2, destination)
+    timezones = TimezoneIndex.shared()
+    return timezones.localize(d1, origin), timezones.localize(d2, destination)
 
 
 #
 
 
-class GoogleSearchCollector(FlightCollector):
+class GoogleSearchCollector(FetchUnitCollector):
+    # Each fetch holds a browser page, so running more than the pool has pages only queues
+    MAX_CONCURRENCY: int = 2
+    BROWSER_POOL_SIZE: int = 2
+    HEADLESS: bool = True
+    FILTERS_FLIGHTS: bool = True
 
     def initialize(self):
         super().initialize()
 
     def collect(self, search: FlightSearch) -> Iterable[Trip]:
         flight_list: list[list[Flight]] = []
-        for leg in search.legs:
-            try:
-                result: Iterable[Flight] = self._get(date=leg.date.strftime("%Y-%m-%d"),
-                                                     origin=leg.origin,
-                                                     destination=leg.destination,
-                                                     journey=search.journey,
-                                                     seat=search.seat,
-                                                     passengers=search.passengers)
-                flight_list.append([r for r in result if r.info.get("is_best", False)])
-            except RuntimeError as e:
-                if "No flights found" in str(e):
-                    continue
-                raise
-
-        combos = itertools.product(*flight_list)
-        for combo in combos:
-            yield Trip(flights=list(combo))
-
-    @staticmethod
-    @functools.cache
-    def _get(*, date: str, origin: str, destination: str, journey: JourneyType, seat: SeatType,
-             passengers: Passengers) -> Iterable[Flight]:
-        fast_flights.core.parse_response = _get_parser(origin=origin, destination=destination, seat=seat)
-        return list(get_flights(
+        for unit in self.fetch_units(search):
+            result: Iterable[Flight] = self._get(unit)
+            flight_list.append(SearchFilter.filter_flights(search.filters,
+                                                           (r for r in result if r.info.get("is_best", False))))
+
+        for combo in combine_legs(flight_list, search.limit):
+            yield Trip.trusted(flights=list(combo))
+
+    @classmethod
+    def fetch_units(cls, search: FlightSearch) -> list[FetchUnit]:
+        # Each leg is its own request, priced for the search's journey type; searches of the same
+        # journey type that share a leg share its request
+        return [FetchUnit(collector=cls,
+                          key=FetchCache.key("google", leg.origin, leg.destination, leg.date,
+                                             search.journey, search.seat, search.passengers),
+                          departure=leg.date,
+                          args=(leg, search.journey, search.seat, search.passengers))
+                for leg in search.legs]
+
+    def fetch_unit(self, unit: FetchUnit) -> Iterable[Flight]:
+        return self._get(unit)
+
+    @classmethod
+    def _get(cls, unit: FetchUnit) -> Iterable[Flight]:
+        leg, journey, seat, passengers = unit.args
+        return cls._cached(unit.key, departure=unit.departure,
+                           fetch=lambda: cls._fetch(date=leg.date.strftime("%Y-%m-%d"),
+                                                    origin=leg.origin,
+                                                    destination=leg.destination,
+                                                    journey=journey,
+                                                    seat=seat,
+                                                    passengers=passengers))
+
+    @classmethod
+    def _fetch(cls, *, date: str, origin: str, destination: str, journey: JourneyType, seat: SeatType,
+               passengers: Passengers) -> list[Flight]:
+        # Everything this request needs is passed along explicitly, so fetches can run side by side
+        tfs = TFSData.from_interface(
             flight_data=[FlightData(date=date,
                                     from_airport=origin,
                                     to_airport=destination)],
@@ -109,9 +117,18 @@ class GoogleSearchCollector(FlightCollector):
             passengers=FFPassengers(adults=passengers.adults,
                                     children=passengers.children,
                                     infants_in_seat=passengers.infants_in_seat,
-                                    infants_on_lap=passengers.infants_on_lap),
-            fetch_mode="local"
-        ))
+                                    infants_on_lap=passengers.infants_on_lap))
+        key = FetchCache.key("google", origin, destination, date, journey, seat, passengers)
+        with Metrics.timed("GoogleSearchCollector.browser"):
+            body = cls._raw(key, lambda: BrowserPool.shared(size=cls.BROWSER_POOL_SIZE,
+                                                            headless=cls.HEADLESS).fetch(_search_url(tfs)))
+        with Metrics.timed("GoogleSearchCollector.parse"):
+            flights = list(_parse_page(body, origin=origin, destination=destination, seat=seat))
+        Metrics.count("GoogleSearchCollector.flights", len(flights))
+        if not flights:
+            # A results page without flights (or one that never finished loading)
+            Metrics.count("GoogleSearchCollector.no_flights")
+        return flights
 
     @classmethod
     def is_allowed(cls, search: FlightSearch) -> bool:
@@ -143,167 +160,92 @@ def _seat_label(seat: SeatType) -> Literal["economy", "premium-economy", "busine
             raise NotImplementedError()
 
 
-def _get_parser(origin: str, destination: str, seat: SeatType) -> Callable[[Response], Iterable[Flight]]:
-    def _parse_flights(r: Response) -> Iterable[Flight]:
-        class _blank:
-            def text(self, *_, **__):
-                return ""
-
-            def iter(self):
-                return []
-
-        blank = _blank()
-
-        def safe(n: LexborNode | None):
-            return n or blank
-
-        parser = LexborHTMLParser(r.text)
-        flights = []
-
-        for i, fl in enumerate(parser.css('div[jsname="IWWDBc"], div[jsname="YdtKid"]')):
-            is_best_flight = i == 0
-
-            for item in fl.css("ul.Rk10dc li")[:-1]:
-                # Flight name
-                name = safe(item.css_first("div.sSHqwe.tPgKwe.ogfYpf span")).text(
-                    strip=True
-                )
-
-                # Get departure & arrival time
-                dp_ar_node = item.css("span.mv1WYe div")
-                try:
-                    departure_time = dp_ar_node[0].text(strip=True)
-                    arrival_time = dp_ar_node[1].text(strip=True)
-                except IndexError:
-                    # sometimes this is not present
-                    departure_time = ""
-                    arrival_time = ""
-
-                # Get arrival time ahead
-                time_ahead = safe(item.css_first("span.bOzv6")).text()
-
-                # Get duration
-                lo_duration = safe(item.css_first("li div.Ak5kof div")).text()
-
-                # Get flight stops
-                stop_count_str = safe(item.css_first(".BbR8Ec .ogfYpf")).text()
-
-                # Get layovers
-                stops = safe(item.css_first(".BbR8Ec .sSHqwe")).text()
-                layovers = []
-                for stop in stops.split(","):
-                    if m := LAYOVER_RE.match(stop):
-                        lo_duration = m.group(1)
-                        airport = m.group(5)
-                        layovers.append({
-                            "duration": _parse_duration(lo_duration),
-                            "airport": airport,
-                        })
-
-                # Get delay
-                delay = safe(item.css_first(".GsCCve")).text() or None
-
-                # Get prices
-                price_str = safe(item.css_first(".YMlIz.FpEdX")).text() or "0"
-
-                # Stops formatting
-                try:
-                    stop_count = 0 if stop_count_str == "Nonstop" else int(stop_count_str.split(" ", 1)[0])
-                except ValueError:
-                    stop_count = "Unknown"
-
-                try:
-                    price = float(price_str[1:])
-                    currency = price_str[0]
-                except ValueError:
-                    continue
-                dep, arr = _parse_dates(date_start=" ".join(departure_time.split()),
-                                        date_end=" ".join(arrival_time.split()),
-                                        duration=lo_duration,
-                                        origin=origin,
-                                        destination=destination)
-                airlines = [n.strip() for n in name.split(",")]
-
-                hops = [Hop(origin=origin,
-                            destination=destination,
-                            departure_time=dep,
-                            arrival_time=arr,
-                            airline=airlines[0],
-                            tickets=[Ticket(price=float(price),
-                                            currency=currency,
-                                            seat_type=seat,
-                                            checked_bags=1,
-                                            carryon_bags=1)]
-                            )]
-                for layover in layovers:
-                    stop = layover.get("airport", "?")
-                    lo_duration = layover.get("duration", timedelta(0))
-                    journey_duration = (hops[-1].arrival_time - hops[-1].departure_time)
-                    mid = hops[-1].departure_time + (journey_duration / 2)
-                    hops.append(Hop(origin=stop,
-                                    destination=hops[-1].destination,
-                                    departure_time=mid + (lo_duration / 2),
-                                    arrival_time=hops[-1].arrival_time,
-                                    airline=airlines[len(hops)] if len(hops) < len(airlines) else "?",
-                                    tickets=[Ticket(price=0,
-                                                    currency=currency,
-                                                    seat_type=seat,
-                                                    checked_bags=1,
-                                                    carryon_bags=1)]
-                                    ))
-                    hops[-2].arrival_time = mid - (lo_duration / 2)
-                    hops[-2].destination = stop
-
-                yield Flight(hops=hops, info={"is_best": is_best_flight})
-    return _parse_flights
-
-    # current_price = safe(parser.css_first("span.gOatQ")).text()
-    # if not flights:
-    #     raise RuntimeError("No flights found:\n{}".format(r.text_markdown))
-    #
-    # return Result(current_price=current_price, flights=[Flight(**fl) for fl in flights])
+# Everything the parser reads from a result item, matched in a single query per item
+ITEM_FIELDS = "div.sSHqwe.tPgKwe.ogfYpf span, span.mv1WYe div, .BbR8Ec .sSHqwe, .YMlIz.FpEdX"
+_selectors = threading.local()
 
 
-#
-# MONKEY PATCHES
-def apply_patches():
-
-    async def fetch_with_playwright(url: str) -> str:
-        latest_error: Exception | None = None
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=False)
-            page = await browser.new_page()
-            await page.goto(url)
-            if page.url.startswith("https://consent.google.com"):
-                await page.click('text="Accept all"')
-
-            await asyncio.sleep(3)
-            for i in range(5):
-                try:
-                    body = await page.evaluate(
-                        "() => document.querySelector('[role=\"main\"]').innerHTML"
-                    )
-                except Exception as e:
-                    latest_error = e
-                    await asyncio.sleep(1)
-                    continue
-                else:
-                    return body
-            # await page.wait_for_selector('[role="main"] [role="listitem"]', timeout=30000)t browser.close()
-        raise Exception("Could not get the page") from latest_error
-
-    def local_playwright_fetch(params: dict) -> Any:
-        url = "https://www.google.com/travel/flights?" + "&".join(f"{k}={v}" for k, v in params.items())
-        body = asyncio.run(fetch_with_playwright(url))
-
-        class DummyResponse:
-            status_code = 200
-            text = body
-            text_markdown = body
-
-        return DummyResponse
-
-    fast_flights.local_playwright.fetch_with_playwright = fetch_with_playwright
-    fast_flights.local_playwright.local_playwright_fetch = local_playwright_fetch
-
-apply_patches()
+def _search_url(tfs: TFSData) -> str:
+    return SEARCH_URL + "?" + urlencode({"tfs": tfs.as_b64().decode("utf-8"), "hl": "en", "tfu": "EgQIABABIgA"})
+
+
+def _parse_page(html: str, *, origin: str, destination: str, seat: SeatType) -> Iterator[Flight]:
+    parser = LexborHTMLParser(html)
+
+    for i, fl in enumerate(parser.css('div[jsname="IWWDBc"], div[jsname="YdtKid"]')):
+        is_best_flight = i == 0
+
+        for item in fl.css("ul.Rk10dc li")[:-1]:
+            name, times, stops, price_str = _item_fields(item)
+
+            try:
+                price = float(price_str[1:].replace(",", ""))
+                currency = price_str[0]
+            except ValueError:
+                continue
+            if len(times) < 2:
+                # sometimes this is not present
+                continue
+            dep, arr = _parse_dates(date_start=times[0],
+                                    date_end=times[1],
+                                    origin=origin,
+                                    destination=destination)
+            yield Flight.trusted(hops=_hops(origin, destination, dep, arr, _parse_layovers(stops),
+                                            [n.strip() for n in name.split(",")], price, currency, seat),
+                                 info={"is_best": is_best_flight})
+
+
+def _item_fields(item: LexborNode) -> tuple[str, list[str], str, str]:
+    # Sorts the matches of ITEM_FIELDS by what they are; for each field the first match wins
+    name, times, stops, price = None, [], None, None
+    if (selector := getattr(_selectors, "item", None)) is None:
+        selector = _selectors.item = LexborCSSSelector()
+    for node in selector.find(ITEM_FIELDS, item):
+        classes = (node.attributes.get("class") or "").split()
+        if "YMlIz" in classes and "FpEdX" in classes:
+            if price is None:
+                price = node.text()
+        elif "sSHqwe" in classes:
+            if stops is None:
+                stops = node.text()
+        elif node.tag == "span":
+            if name is None:
+                name = node.text(strip=True)
+        elif len(times) < 2:
+            times.append(" ".join(node.text(strip=True).split()))
+    return name or "", times, stops or "", price or "0"
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_layovers(stops: str) -> tuple[tuple[str, timedelta], ...]:
+    layovers = []
+    for stop in stops.split(","):
+        if m := LAYOVER_RE.match(stop.strip()):
+            layovers.append((m.group(2), _parse_duration(m.group(1))))
+    return tuple(layovers)
+
+
+def _hops(origin: str, destination: str, dep: datetime, arr: datetime,
+          layovers: Iterable[tuple[str, timedelta]], airlines: list[str],
+          price: float, currency: str, seat: SeatType) -> list[Hop]:
+    # Google only gives the layover airports and durations, so each layover is placed in the
+    # middle of whatever is left of the journey after the previous one
+    legs: list[tuple[str, datetime]] = [(origin, dep)]
+    arrivals: list[datetime] = []
+    for airport, duration in layovers:
+        mid = legs[-1][1] + (arr - legs[-1][1]) / 2
+        arrivals.append(mid - (duration / 2))
+        legs.append((airport, mid + (duration / 2)))
+    arrivals.append(arr)
+
+    return [Hop.trusted(origin=stop,
+                        destination=legs[k + 1][0] if k + 1 < len(legs) else destination,
+                        departure_time=departure,
+                        arrival_time=arrivals[k],
+                        airline=airlines[k] if k < len(airlines) else "?",
+                        tickets=[Ticket.trusted(price=price if k == 0 else 0.0,
+                                                currency=currency,
+                                                seat_type=seat,
+                                                checked_bags=1,
+                                                carryon_bags=1)])
+            for k, (stop, departure) in enumerate(legs)]
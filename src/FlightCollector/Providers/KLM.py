@@ -1,40 +1,50 @@
 from __future__ import annotations
 
-from typing import Iterable
+from typing import Iterable, AsyncIterator
+import importlib.util
+import atexit
 import tomlkit
 import httpx
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 import json
-import ratelimit
-import pytz
-import airporttime
-from ratelimit import sleep_and_retry
+import time
 
 from Data import Flight, JourneyType, FlightSearch, Trip, Passengers, LegSearch, Hop, Ticket
-from FlightCollector.FlightCollector import FlightCollector
+from FlightCollector.FlightCollector import FlightCollector, AsyncFlightCollector, FetchUnitCollector, FetchUnit
+from FlightCollector.Cache import FetchCache
+from FlightCollector.RateLimit import SharedRateLimiter, RateLimited
+from FlightCollector.EventLoop import BackgroundLoop
+from FlightCollector.Timezones import TimezoneIndex
+from FlightCollector.Metrics import Metrics
 
 
 #
 
 
 def _parse_datetime(s: str, loc: str) -> datetime:
-    d = datetime.fromisoformat(s)
-    if loc == "PKX":
-        tz = pytz.timezone("Asia/Shanghai")
-        return d.replace(tzinfo=tz)
-    try:
-        apt = airporttime.AirportTime(iata_code=loc)
-        return apt.from_utc(apt.to_utc(d))
-    except TypeError:
-        return d
+    return TimezoneIndex.shared().localize(datetime.fromisoformat(s), loc)
+
+
+def _departs_on(connection: dict, d: str) -> bool:
+    segments = connection.get("segments")
+    return bool(segments) and segments[0]["departureDateTime"].startswith(d)
+
+
+_CALENDAR_EPOCH = date(2000, 1, 3)
 
 
 #
 
 
-class KLMSearchCollector(FlightCollector):
+class KLMSearchCollector(FetchUnitCollector):
     API_KEY: str | None = None
     API_URL: str = "https://api.airfranceklm.com/opendata/offers/v3/lowest-fare-offers"
+    MAX_CONCURRENCY: int = 4
+    # Shared by every KLM collector in every local process; starts at one call per 1.5s
+    RATE_LIMITER: SharedRateLimiter = SharedRateLimiter("klm", rate=1 / 1.5)
+    MAX_RETRIES: int = 3  # for requests turned away with a 429
+    # Days covered by one request per leg (see _window); None asks for each search's own dates only
+    CALENDAR_DAYS: int | None = None
     client: httpx.Client
 
     def __init__(self, *args, **kwargs):
@@ -44,21 +54,35 @@ class KLMSearchCollector(FlightCollector):
 
     def initialize(self):
         super().initialize()
+        self._load_config()
+        self.client = httpx.Client(headers=self._headers())
+        self.is_initialized = True
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        self.is_initialized = False
+        super().close()
+
+    def _load_config(self):
+        # Read once and kept on the class, so every KLM collector after the first skips the file
         if self.API_KEY is None:
+            cls = KLMSearchCollector
             try:
                 with open(self._CONFIG_FILE, "r") as f:
                     config = tomlkit.load(f)
                     if "klm" not in config:
                         raise ValueError("KLM API key not found in config file")
-                    self.API_KEY = config["klm"]["api_key"]
-                    self.API_URL = config["klm"]["api_url"]
+                    cls.API_KEY = str(config["klm"]["api_key"])
+                    cls.API_URL = str(config["klm"]["api_url"])
             except IOError as e:
                 raise ValueError("Config file not found, and KLM API key is not set.") from e
-        self.client = httpx.Client(
-            headers={"API-Key": self.API_KEY,
-                     "Content-Type": "application/hal+json",
-                     "AFKL-TRAVEL-Host": "KL"})
-        self.is_initialized = True
+
+    def _headers(self) -> dict[str, str]:
+        return {"API-Key": self.API_KEY,
+                "Content-Type": "application/hal+json",
+                "AFKL-TRAVEL-Host": "KL"}
 
     def collect(self, search: FlightSearch) -> Iterable[Trip]:
         if not self.is_initialized:
@@ -67,61 +91,158 @@ class KLMSearchCollector(FlightCollector):
         try:
             results = self._request(search)
             if results is not None:
-                connections_map: dict[int, Flight] = {
-                    connection["id"]: Flight(hops=[Hop(
-                        origin=hop["origin"]["code"],
-                        destination=hop["destination"]["code"],
-                        departure_time=_parse_datetime(hop["departureDateTime"], hop["origin"]["code"]),
-                        arrival_time=_parse_datetime(hop["arrivalDateTime"], hop["destination"]["code"]),
-                        airline=hop["marketingFlight"]["carrier"]["name"],
-                        tickets=[Ticket(price=0, currency=search.currency, seat_type=search.seat,
-                                        checked_bags=1, carryon_bags=1)])
-                        for hop in connection.get("segments", [])])
-                    for leg in results.get("connections", [])
-                    for connection in leg
-                }
-
-                for recommendation in results.get("recommendations", []):
-                    for product in recommendation["flightProducts"]:
-                        if any(c["connectionId"] not in connections_map for c in product["connections"]):
-                            continue
-                        flights = []
-                        for connection in product["connections"]:
-                            price = connection["price"]["totalPrice"]
-                            currency = connection["price"]["currency"]
-                            ticket = Ticket(price=price, currency=currency,
-                                            checked_bags=1, carryon_bags=1, seat_type=search.seat)
-                            flight = connections_map[connection["connectionId"]]
-                            flight.hops[0].tickets[0] = ticket
-                            flights.append(flight)
-                        yield Trip(flights=flights)
+                yield from self._limit(self._parse(results, search), search)
             else:
                 print("Empty response")
 
         except Exception as e:
-            yield from ()
+            self._failed(search, e)
+            raise
+
+    @classmethod
+    def _failed(cls, search: FlightSearch, e: Exception):
+        # Logged here and re-raised, so the planner can tell a failed search from one without results
+        # (it records the error itself)
+        route = ", ".join(f"{leg.origin}->{leg.destination} {leg.date:%Y-%m-%d}" for leg in search.legs)
+        print(f"KLM search failed ({route}): {type(e).__name__}: {e}")
+
+    @classmethod
+    def _parse(cls, results: dict, search: FlightSearch) -> Iterable[Trip]:
+        # A calendar response covers every search in the same date windows, so only the connections
+        # leaving on this search's own dates are kept (connections are listed per requested leg)
+        dates = [leg.date.isoformat() for leg in search.legs] if cls.CALENDAR_DAYS is not None else None
+        connections_map: dict[int, list[Hop]] = {
+            connection["id"]: [Hop.trusted(
+                origin=hop["origin"]["code"],
+                destination=hop["destination"]["code"],
+                departure_time=_parse_datetime(hop["departureDateTime"], hop["origin"]["code"]),
+                arrival_time=_parse_datetime(hop["arrivalDateTime"], hop["destination"]["code"]),
+                airline=hop["marketingFlight"]["carrier"]["name"],
+                tickets=[Ticket.trusted(price=0.0, currency=search.currency, seat_type=search.seat,
+                                        checked_bags=1, carryon_bags=1)])
+                for hop in connection.get("segments", [])]
+            for i, leg in enumerate(results.get("connections", []))
+            for connection in leg
+            if dates is None or (i < len(dates) and _departs_on(connection, dates[i]))
+        }
+
+        for recommendation in results.get("recommendations", []):
+            for product in recommendation["flightProducts"]:
+                if any(c["connectionId"] not in connections_map for c in product["connections"]):
+                    continue
+                flights = []
+                for connection in product["connections"]:
+                    price = connection["price"]["totalPrice"]
+                    currency = connection["price"]["currency"]
+                    ticket = Ticket.trusted(price=float(price), currency=currency,
+                                            checked_bags=1, carryon_bags=1, seat_type=search.seat)
+                    # Connections are shared between products, so each priced flight gets its own hops
+                    hops = connections_map[connection["connectionId"]]
+                    flights.append(Flight.trusted(hops=[Hop.trusted(origin=hop.origin,
+                                                                    destination=hop.destination,
+                                                                    departure_time=hop.departure_time,
+                                                                    arrival_time=hop.arrival_time,
+                                                                    airline=hop.airline,
+                                                                    tickets=[ticket] if i == 0 else hop.tickets)
+                                                        for i, hop in enumerate(hops)]))
+                yield Trip(flights=flights)
+
+    @classmethod
+    def _limit(cls, trips: Iterable[Trip], search: FlightSearch) -> Iterable[Trip]:
+        if search.limit is None or search.limit.unbounded:
+            return trips
+        return search.limit.select(trips)
+
+    @classmethod
+    def fetch_units(cls, search: FlightSearch) -> list[FetchUnit]:
+        # In calendar mode every search falling in the same windows maps to the same request
+        return [FetchUnit(collector=cls, key=cls._cache_key(search), departure=cls._window(search.legs[0].date)[0],
+                          args=search)]
+
+    def fetch_unit(self, unit: FetchUnit) -> dict:
+        if not self.is_initialized:
+            self.initialize()
+        return self._request(unit.args)
 
-    @sleep_and_retry
-    @ratelimit.limits(calls=1, period=1.5)
     def _request(self, search: FlightSearch) -> dict:
-        print(f"Requesting KLM data for the following trips:")
-        for leg in search.legs:
-            print(f" - ({leg.origin} -> {leg.destination}) on {leg.date:%Y-%m-%d.}")
-        res = self.client.post(self.API_URL,
-                              json={
-                                  "bookingFlow": "LEISURE",
-                                  "commercialCabins": ["ECONOMY"],
-                                  "passengers": list(self._convert_passengers(search.passengers)),
-                                  "currency": search.currency,
-                                  "requestedConnections": [
-                                      self._convert_leg(leg) for leg in search.legs
-                                  ],
-                                  "displayPriceContent": "ALL_PAX"
-                              })
+        # The fetch span includes the rate limiter's sleeps; "http" is only the request itself
+        return self._cached(self._cache_key(search), departure=self._window(search.legs[0].date)[0],
+                            fetch=lambda: self._post(search))
+
+    def _post(self, search: FlightSearch) -> dict:
+        self._log_request(search)
+        attempt = 0
+        while True:
+            self.RATE_LIMITER.acquire()
+            start = time.perf_counter()
+            try:
+                with Metrics.timed(f"{type(self).__name__}.http"):
+                    result = self._raw(self._cache_key(search), lambda: self._send(search))
+            except RateLimited as e:
+                self.RATE_LIMITER.throttled(e.retry_after)
+                attempt = self._retry(e, attempt)
+                continue
+            self.RATE_LIMITER.succeeded(time.perf_counter() - start)
+            return result
+
+    def _send(self, search: FlightSearch) -> dict:
+        res = self.client.post(self.API_URL, json=self._payload(search))
+        return self._content(res)
+
+    @classmethod
+    def _content(cls, res: httpx.Response) -> dict:
+        Metrics.count(f"{cls.__name__}.status.{res.status_code}")
+        if res.status_code == 429:
+            raise RateLimited(f"KLM API error: {res.status_code} {res.reason_phrase}: {res.text}",
+                              retry_after=RateLimited.parse_retry_after(res.headers.get("Retry-After")))
         if res.is_error:
             raise RuntimeError(f"KLM API error: {res.status_code} {res.reason_phrase}: {res.text}")
-        content = res.json()
-        return content
+        return res.json()
+
+    def _retry(self, e: RateLimited, attempt: int) -> int:
+        # Returns the next attempt number, or re-raises once out of retries
+        if attempt >= self.MAX_RETRIES:
+            raise e
+        Metrics.count(f"{type(self).__name__}.retries")
+        return attempt + 1
+
+    @classmethod
+    def _cache_key(cls, search: FlightSearch) -> str:
+        if cls.CALENDAR_DAYS is None:
+            return FetchCache.key("klm", search.currency, search.seat, search.passengers,
+                                  *((leg.origin, leg.destination, leg.date) for leg in search.legs))
+        return FetchCache.key("klm-calendar", search.currency, search.seat, search.passengers,
+                              *((leg.origin, leg.destination, *cls._window(leg.date)) for leg in search.legs))
+
+    @classmethod
+    def _window(cls, d: date) -> tuple[date, date]:
+        # Windows are fixed CALENDAR_DAYS-long stretches counted from 2000-01-03 (a Monday), so every
+        # date in one maps to the same request.  Days already past are left off the front.
+        if cls.CALENDAR_DAYS is None:
+            return d, d
+        start = d - timedelta(days=(d - _CALENDAR_EPOCH).days % cls.CALENDAR_DAYS)
+        return max(start, min(d, date.today())), start + timedelta(days=cls.CALENDAR_DAYS - 1)
+
+    @classmethod
+    def _payload(cls, search: FlightSearch) -> dict:
+        return {
+            "bookingFlow": "LEISURE",
+            "commercialCabins": ["ECONOMY"],
+            "passengers": list(cls._convert_passengers(search.passengers)),
+            "currency": search.currency,
+            "requestedConnections": [
+                cls._convert_leg(leg) for leg in search.legs
+            ],
+            "displayPriceContent": "ALL_PAX"
+        }
+
+    @classmethod
+    def _log_request(cls, search: FlightSearch):
+        print(f"Requesting KLM data for the following trips:")
+        for leg in search.legs:
+            start, end = cls._window(leg.date)
+            dates = f"{start:%Y-%m-%d}" if start == end else f"{start:%Y-%m-%d} to {end:%Y-%m-%d}"
+            print(f" - ({leg.origin} -> {leg.destination}) on {dates}.")
 
     @classmethod
     def is_allowed(cls, search: FlightSearch) -> bool:
@@ -140,10 +261,11 @@ class KLMSearchCollector(FlightCollector):
 
     @classmethod
     def _convert_leg(cls, leg: LegSearch) -> dict:
-        d = cls._date_format(leg.date)
+        start, end = cls._window(leg.date)
+        d = cls._date_format(start)
         return {
             "departureDate": d,
-            "dateInterval": f"{d}/{d}",
+            "dateInterval": f"{d}/{cls._date_format(end)}",
             "origin": {
                 "type": "AIRPORT",
                 "code": leg.origin
@@ -157,3 +279,110 @@ class KLMSearchCollector(FlightCollector):
     @classmethod
     def _date_format(cls, d: date) -> str:
         return d.strftime("%Y-%m-%d")
+
+
+#
+
+
+class AsyncKLMSearchCollector(AsyncFlightCollector, KLMSearchCollector):
+    # Same API and parsing as KLMSearchCollector, but every instance shares one keep-alive
+    # (HTTP/2 when `h2` is installed) AsyncClient and waits on the rate limiter without blocking,
+    # so queued requests don't hold on to worker threads.
+    MAX_CONCURRENCY: int = 16
+    _async_client: httpx.AsyncClient | None = None
+    _connections: int | None = None  # the concurrency of the run using the client, if it was told
+    _close_registered: bool = False
+
+    def initialize(self):
+        FlightCollector.initialize(self)
+        self._load_config()
+        self.is_initialized = True
+
+    async def collect(self, search: FlightSearch) -> AsyncIterator[Trip]:
+        if not self.is_initialized:
+            self.initialize()
+
+        try:
+            results = await self._request_async(search)
+            if results is not None:
+                for trip in self._limit(self._parse(results, search), search):
+                    yield trip
+            else:
+                print("Empty response")
+
+        except Exception as e:
+            self._failed(search, e)
+            raise
+
+    async def fetch_unit(self, unit: FetchUnit) -> dict:
+        if not self.is_initialized:
+            self.initialize()
+        return await self._request_async(unit.args)
+
+    async def _request_async(self, search: FlightSearch) -> dict:
+        return await self._cached_async(self._cache_key(search), departure=self._window(search.legs[0].date)[0],
+                                        fetch=lambda: self._post_async(search))
+
+    async def _post_async(self, search: FlightSearch) -> dict:
+        self._log_request(search)
+        attempt = 0
+        while True:
+            await self.RATE_LIMITER.acquire_async()
+            start = time.perf_counter()
+            try:
+                with Metrics.timed(f"{type(self).__name__}.http"):
+                    result = await self._raw_async(self._cache_key(search), lambda: self._send_async(search))
+            except RateLimited as e:
+                await self.RATE_LIMITER.throttled_async(e.retry_after)
+                attempt = self._retry(e, attempt)
+                continue
+            await self.RATE_LIMITER.succeeded_async(time.perf_counter() - start)
+            return result
+
+    async def _send_async(self, search: FlightSearch) -> dict:
+        res = await self._client().post(self.API_URL, json=self._payload(search))
+        return self._content(res)
+
+    @classmethod
+    def set_concurrency(cls, limit: int):
+        # The shared client's connection pool is sized for the run; one sized for another is replaced
+        if limit != AsyncKLMSearchCollector._connections:
+            AsyncKLMSearchCollector._connections = limit
+            AsyncKLMSearchCollector._close_client()
+
+    def _client(self) -> httpx.AsyncClient:
+        cls = AsyncKLMSearchCollector
+        if cls._async_client is None or cls._async_client.is_closed:
+            connections = cls._connections or cls.MAX_CONCURRENCY
+            cls._async_client = httpx.AsyncClient(
+                headers=self._headers(),
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=httpx.Limits(max_connections=connections,
+                                    max_keepalive_connections=connections,
+                                    keepalive_expiry=60),
+                timeout=httpx.Timeout(30))
+            if not cls._close_registered:
+                atexit.register(cls._close_client)
+                cls._close_registered = True
+        return cls._async_client
+
+    @classmethod
+    def _close_client(cls):
+        client, cls._async_client = cls._async_client, None
+        if client is not None and not client.is_closed:
+            loop = BackgroundLoop.shared()
+            if not loop.closed:
+                loop.run(client.aclose())
+
+
+#
+
+
+class KLMCalendarCollector(KLMSearchCollector):
+    # One request per week-long window of each leg instead of one per date, split back into
+    # per-date trips.  A two-week round trip takes 4-9 requests rather than 196.
+    CALENDAR_DAYS: int | None = 7
+
+
+class AsyncKLMCalendarCollector(AsyncKLMSearchCollector):
+    CALENDAR_DAYS: int | None = 7
@@ -1,2 +1,3 @@
 from FlightCollector.Providers.Google import GoogleSearchCollector
-from FlightCollector.Providers.KLM import KLMSearchCollector
+from FlightCollector.Providers.KLM import KLMSearchCollector, AsyncKLMSearchCollector, KLMCalendarCollector, \
+    AsyncKLMCalendarCollector
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Callable, TypeVar
+import threading
+import pathlib
+import sqlite3
+import asyncio
+import time
+import os
+
+from FlightCollector.Metrics import Metrics
+
+
+_HOME = str(pathlib.Path.home())
+T = TypeVar("T")
+
+
+#
+
+
+class RateLimited(RuntimeError):
+    # A provider turned a request away for going too fast; `retry_after` is its hint in seconds
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @classmethod
+    def parse_retry_after(cls, value: str | None) -> float | None:
+        # Retry-After is either a number of seconds or an HTTP date
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+#
+
+
+class SharedRateLimiter:
+    # Token bucket for one provider, kept in a small sqlite database so every thread and every local
+    # process calling that provider draws from the same budget.  Callers reserve a token inside a
+    # short write transaction (the balance may go negative, which is the queue) and sleep off their
+    # place in line outside it.  The refill `rate` (calls per second) adapts between `min_rate` and
+    # `max_rate`: it's cut by `decrease` and paused for the Retry-After on a 429, raised by `increase`
+    # after every success, and eased off when responses take longer than `latency_target` seconds.
+    _IDLE_RESET: float = 600  # a bucket nobody has touched for this long starts over at max_rate
+
+    def __init__(self, name: str, rate: float, burst: float = 1.0, min_rate: float | None = None,
+                 max_rate: float | None = None, increase: float | None = None, decrease: float = 0.5,
+                 latency_target: float | None = None, path: str | None = None):
+        self.name = name
+        self.burst = burst
+        self.max_rate = rate if max_rate is None else max_rate
+        self.min_rate = rate / 10 if min_rate is None else min_rate
+        self.rate = rate
+        self.increase = rate / 20 if increase is None else increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.path = path or os.path.join(_HOME, ".flights/ratelimit.sqlite")
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS buckets ("
+                               "name TEXT PRIMARY KEY, tokens REAL, updated REAL, rate REAL)")
+        return self._conn
+
+    #
+
+    def acquire(self):
+        if (wait := self._reserve()) > 0:
+            with Metrics.timed(f"ratelimit.{self.name}.wait"):
+                time.sleep(wait)
+
+    async def acquire_async(self):
+        # The reservation can wait on sqlite's lock while another thread or process holds the bucket,
+        # so it runs on a worker thread instead of holding up the event loop
+        if (wait := await asyncio.to_thread(self._reserve)) > 0:
+            with Metrics.timed(f"ratelimit.{self.name}.wait"):
+                await asyncio.sleep(wait)
+
+    def throttled(self, retry_after: float | None = None):
+        # Called on a 429.  Nothing refills until the retry time has passed, and the rate is only cut
+        # once per pause, since the requests already waiting in line will mostly be turned away too.
+        Metrics.count(f"ratelimit.{self.name}.throttled")
+
+        def _update(tokens: float, updated: float, rate: float, now: float):
+            if updated > now:
+                return tokens, updated, rate, None
+            # Reservations already served have been refilled since `updated`; only the rest is still owed
+            tokens = min(self.burst, tokens + (now - updated) * rate)
+            rate = max(self.min_rate, rate * self.decrease)
+            return min(tokens, 0.0), now + (retry_after if retry_after is not None else 1 / rate), rate, None
+
+        self._update(_update)
+
+    async def throttled_async(self, retry_after: float | None = None):
+        await asyncio.to_thread(self.throttled, retry_after)
+
+    def succeeded(self, latency: float | None = None):
+        def _update(tokens: float, updated: float, rate: float, now: float):
+            if self.latency_target is not None and latency is not None and latency > self.latency_target:
+                rate = max(self.min_rate, rate * max(self.decrease, self.latency_target / latency))
+            else:
+                rate = min(self.max_rate, rate + self.increase)
+            return tokens, updated, rate, None
+
+        self._update(_update)
+
+    async def succeeded_async(self, latency: float | None = None):
+        await asyncio.to_thread(self.succeeded, latency)
+
+    #
+
+    def _reserve(self) -> float:
+        # Takes a token and returns how long to wait before using it
+        def _update(tokens: float, updated: float, rate: float, now: float):
+            start = max(now, updated)
+            tokens = min(self.burst, tokens + (start - updated) * rate) - 1
+            return tokens, start, rate, start - now + max(0.0, -tokens) / rate
+
+        return self._update(_update)
+
+    def _update(self, update: Callable[[float, float, float, float], tuple[float, float, float, T]]) -> T:
+        # Applies `update` to the stored (tokens, updated, rate) and the current time in one write
+        # transaction.  `updated` is in the future while the bucket is paused after a 429.
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated, rate FROM buckets WHERE name = ?",
+                                   (self.name,)).fetchone()
+                if row is None or now - row[1] > self._IDLE_RESET:
+                    row = (self.burst, now, self.max_rate)
+                rate = min(self.max_rate, max(self.min_rate, row[2]))
+                tokens, updated, rate, result = update(row[0], row[1], rate, now)
+                conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated, rate) VALUES (?, ?, ?, ?)",
+                             (self.name, tokens, updated, rate))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self.rate = rate
+        Metrics.gauge(f"ratelimit.{self.name}.rate", rate)
+        Metrics.gauge(f"ratelimit.{self.name}.queue", max(0.0, -(tokens + max(0.0, now - updated) * rate)))
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
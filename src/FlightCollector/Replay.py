@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+from SprelfJSON import JSONModel
+
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Awaitable, Iterator, Mapping, TypeVar
+import threading
+import hashlib
+import asyncio
+import random
+import gzip
+import json
+import time
+import os
+
+from FlightCollector.Metrics import Metrics
+from FlightCollector.RateLimit import RateLimited
+
+T = TypeVar("T")
+
+
+#
+
+
+class ReplayError(RuntimeError):
+    ...
+
+
+class ReplayRateLimited(ReplayError, RateLimited):
+    ...
+
+
+class ReplayConditions(JSONModel):
+    # How replayed responses are served.  Latency is the recorded one times `latency_scale`, or
+    # `latency_mean` seconds when that's set, spread lognormally by `latency_sigma` (same mean).
+    latency_scale: float = 1.0
+    latency_mean: float | None = None
+    latency_sigma: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_calls: int | None = None  # calls allowed per `rate_limit_period`; more are rejected
+    rate_limit_period: float = 1.0
+
+    def latency(self, recorded: float, rnd: random.Random) -> float:
+        base = self.latency_mean if self.latency_mean is not None else recorded * self.latency_scale
+        if self.latency_sigma > 0:
+            base *= rnd.lognormvariate(-self.latency_sigma ** 2 / 2, self.latency_sigma)
+        return max(0.0, base)
+
+
+#
+
+
+class Tape:
+    # Raw provider responses (Google pages, KLM JSON) saved under `path`, one gzipped file per
+    # request.  While a Tape is active every FlightCollector._raw call goes through it: recording
+    # makes the real request and saves what came back (failures included), replaying serves the
+    # saved response under the simulated conditions without touching the network.  Conditions are
+    # looked up by collector class name along the MRO, with "*" as the fallback.
+    active: Tape | None = None
+
+    def __init__(self, path: str, record: bool = False,
+                 conditions: Mapping[str, ReplayConditions] | ReplayConditions | None = None, seed: int = 0):
+        self.path = path
+        self.record = record
+        if isinstance(conditions, ReplayConditions):
+            conditions = {"*": conditions}
+        self.conditions: dict[str, ReplayConditions] = dict(conditions or {})
+        self.seed = seed
+        self._calls: dict[str, int] = {}
+        self._windows: dict[str, deque[float]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    @contextmanager
+    def recording(cls, path: str) -> Iterator[Tape]:
+        with cls._activate(Tape(path, record=True)) as tape:
+            yield tape
+
+    @classmethod
+    @contextmanager
+    def replaying(cls, path: str, conditions: Mapping[str, ReplayConditions] | ReplayConditions | None = None,
+                  seed: int = 0) -> Iterator[Tape]:
+        with cls._activate(Tape(path, conditions=conditions, seed=seed)) as tape:
+            yield tape
+
+    @classmethod
+    @contextmanager
+    def _activate(cls, tape: Tape) -> Iterator[Tape]:
+        previous, cls.active = cls.active, tape
+        try:
+            yield tape
+        finally:
+            cls.active = previous
+
+    #
+
+    def fetch(self, collector: type, key: str, producer: Callable[[], T]) -> T:
+        if self.record:
+            start = time.perf_counter()
+            try:
+                value = producer()
+            except Exception as e:
+                self._save(collector, key, time.perf_counter() - start, error=e)
+                raise
+            self._save(collector, key, time.perf_counter() - start, value=value)
+            return value
+        entry, delay, error = self._serve(collector, key)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return entry["value"]
+
+    async def fetch_async(self, collector: type, key: str, producer: Callable[[], Awaitable[T]]) -> T:
+        if self.record:
+            start = time.perf_counter()
+            try:
+                value = await producer()
+            except Exception as e:
+                self._save(collector, key, time.perf_counter() - start, error=e)
+                raise
+            self._save(collector, key, time.perf_counter() - start, value=value)
+            return value
+        entry, delay, error = self._serve(collector, key)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return entry["value"]
+
+    def keys(self) -> Iterator[str]:
+        if not os.path.isdir(self.path):
+            return
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(".json.gz"):
+                with gzip.open(os.path.join(self.path, name), "rt", encoding="utf-8") as f:
+                    yield json.load(f)["key"]
+
+    #
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ".json.gz")
+
+    def _save(self, collector: type, key: str, seconds: float, value: Any = None, error: Exception | None = None):
+        entry = {"key": key, "collector": collector.__name__, "seconds": seconds,
+                 "recorded": datetime.now(timezone.utc).isoformat()}
+        if error is not None:
+            entry["error"] = {"type": type(error).__name__, "message": str(error)}
+        else:
+            entry["value"] = value
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+        Metrics.count("tape.recorded")
+
+    def _serve(self, collector: type, key: str) -> tuple[dict, float, Exception | None]:
+        # Everything random is drawn from the key and how often it's been asked for, so a replay
+        # doesn't depend on the order concurrent requests happen to arrive in
+        name, conditions = self._conditions(collector)
+        with self._lock:
+            n = self._calls[key] = self._calls.get(key, 0) + 1
+        rnd = random.Random(f"{self.seed}|{key}|{n}")
+        try:
+            with gzip.open(self._file(key), "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            raise ReplayError(f"No recording for {key}") from None
+        Metrics.count("tape.replayed")
+
+        delay = conditions.latency(entry["seconds"], rnd)
+        if (retry_after := self._throttle(name, conditions)) is not None:
+            Metrics.count("tape.rate_limited")
+            return entry, 0.0, ReplayRateLimited(f"429 Too Many Requests (replayed {key})", retry_after)
+        if rnd.random() < conditions.error_rate:
+            Metrics.count("tape.simulated_errors")
+            return entry, delay, ReplayError(f"Simulated error (replayed {key})")
+        if "error" in entry:
+            return entry, delay, ReplayError(entry["error"]["message"])
+        return entry, delay, None
+
+    def _conditions(self, collector: type) -> tuple[str, ReplayConditions]:
+        for c in collector.__mro__:
+            if c.__name__ in self.conditions:
+                return c.__name__, self.conditions[c.__name__]
+        return "*", self.conditions.get("*") or ReplayConditions()
+
+    def _throttle(self, name: str, conditions: ReplayConditions) -> float | None:
+        # Sliding window per conditions entry; returns how long to wait when the call is rejected
+        if conditions.rate_limit_calls is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.setdefault(name, deque())
+            while window and now - window[0] >= conditions.rate_limit_period:
+                window.popleft()
+            if len(window) >= conditions.rate_limit_calls:
+                return conditions.rate_limit_period - (now - window[0])
+            window.append(now)
+            return None
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from datetime import datetime, tzinfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import threading
+import pathlib
+import json
+import csv
+import os
+
+import airporttime
+
+from FlightCollector.Metrics import Metrics
+
+_HOME = str(pathlib.Path.home())
+
+
+#
+
+
+class TimezoneIndex:
+    # IATA code -> IANA zone for every airport in airporttime's data file, built once from the CSV
+    # and saved as JSON so later runs only have to read a small file.  Codes missing from the data
+    # (or wrong in it) are covered by OVERRIDES; anything else unknown stays naive.
+    PATH: str = os.path.join(_HOME, ".flights/timezones.json")
+    SOURCE: str = airporttime.DATA_SOURCE_FILE
+    OVERRIDES: dict[str, str] = {"PKX": "Asia/Shanghai"}
+    _shared: TimezoneIndex | None = None
+    _lock = threading.Lock()
+
+    def __init__(self, zones: dict[str, str]):
+        self.zones = {**zones, **self.OVERRIDES}
+        self._tz: dict[str, tzinfo | None] = {}
+        self.missing: set[str] = set()
+
+    @classmethod
+    def shared(cls) -> TimezoneIndex:
+        with cls._lock:
+            if cls._shared is None:
+                with Metrics.timed("TimezoneIndex.load"):
+                    cls._shared = cls.load()
+            return cls._shared
+
+    @classmethod
+    def load(cls, path: str | None = None) -> TimezoneIndex:
+        path = path or cls.PATH
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved["source_mtime"] == os.path.getmtime(cls.SOURCE):
+                return cls(saved["zones"])
+        except (IOError, ValueError, KeyError):
+            pass
+        index = cls.build()
+        index.save(path)
+        return index
+
+    @classmethod
+    def build(cls, source: str | None = None) -> TimezoneIndex:
+        zones: dict[str, str] = {}
+        valid: dict[str, bool] = {}
+        with open(source or cls.SOURCE, "r", encoding="utf-8") as f:
+            reader = csv.reader(f, delimiter="^")
+            headers = next(reader)
+            code_i, tz_i = headers.index("iata_code"), headers.index("timezone")
+            for row in reader:
+                code, zone = row[code_i], row[tz_i]
+                # Same first-match rule as airporttime's own lookup
+                if not code or not zone or code in zones:
+                    continue
+                if zone not in valid:
+                    valid[zone] = _zone(zone) is not None
+                if valid[zone]:
+                    zones[code] = zone
+        return cls(zones)
+
+    def save(self, path: str | None = None):
+        path = path or self.PATH
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"source_mtime": os.path.getmtime(self.SOURCE), "zones": self.zones}, f)
+        os.replace(tmp, path)
+
+    def zone(self, code: str) -> tzinfo | None:
+        try:
+            return self._tz[code]
+        except KeyError:
+            tz = self._tz[code] = _zone(self.zones[code]) if code in self.zones else None
+            if tz is None:
+                self.missing.add(code)
+                Metrics.count("TimezoneIndex.missing")
+            return tz
+
+    def localize(self, d: datetime, code: str) -> datetime:
+        # Attaches the airport's zone to a naive local time
+        if d.tzinfo is not None or (tz := self.zone(code)) is None:
+            return d
+        return d.replace(tzinfo=tz)
+
+
+def _zone(name: str) -> tzinfo | None:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
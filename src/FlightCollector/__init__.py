@@ -1,2 +1,8 @@
-from FlightCollector.FlightCollector import FlightCollector
+from FlightCollector.Cache import FetchCache, MemoryCache, DiskCache, TTLPolicy, TTLTier, FetchMemo
+from FlightCollector.FlightCollector import FlightCollector, AsyncFlightCollector, FetchUnitCollector, FetchUnit
+from FlightCollector.Pool import CollectorPool
+from FlightCollector.Timezones import TimezoneIndex
+from FlightCollector.Metrics import Metrics, MetricsHook
+from FlightCollector.RateLimit import SharedRateLimiter, RateLimited
+from FlightCollector.Replay import Tape, ReplayConditions, ReplayError, ReplayRateLimited
 from FlightCollector.Providers import *
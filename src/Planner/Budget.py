@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from SprelfJSON import JSONModel
+from datetime import datetime, timezone
+from typing import Iterable
+import threading
+import time
+
+from Planner.Query import PlannedQuery, PlanResult
+
+
+#
+
+
+class QueryBudget(JSONModel):
+    # Limits on one SearchPlan run: wall-clock `seconds` from the start of the run, an absolute
+    # `deadline`, and/or `max_calls` provider requests (fetches served from the cache are free).
+    # When it runs out no new fetches are started, queries still waiting on one are skipped, and
+    # whatever was gathered is ranked as usual.
+    seconds: float | None = None
+    deadline: datetime | None = None
+    max_calls: int | None = None
+    layover_penalty: float = 0.15  # price fraction added per layover when ordering routes by history
+
+    def start(self) -> BudgetClock:
+        limits = []
+        if self.seconds is not None:
+            limits.append(time.monotonic() + self.seconds)
+        if self.deadline is not None:
+            # A deadline without a timezone is local time, like one written in a plan file would be
+            deadline = self.deadline.astimezone()
+            limits.append(time.monotonic() + (deadline - datetime.now(timezone.utc)).total_seconds())
+        return BudgetClock(expires=min(limits) if limits else None, max_calls=self.max_calls)
+
+    def prioritize(self, queries: Iterable[PlannedQuery], previous: PlanResult | None) -> list[PlannedQuery]:
+        # Most promising first: routes whose earlier results were cheapest (with layovers counted
+        # against them), then routes without history, then queries that found nothing last time.
+        best: dict[tuple, float] = {}
+        if previous is not None:
+            for sqr in previous.results:
+                trip = sqr.query.trip
+                value = trip.cheapest() * (1 + self.layover_penalty * sum(len(f.hops) - 1 for f in trip.flights))
+                route = (sqr.query.collector.__name__,
+                         tuple((f.hops[0].origin, f.hops[-1].destination) for f in trip.flights))
+                best[route] = min(best.get(route, value), value)
+            found = {sqr.query.key for sqr in previous.results}
+            empty = {k for k in previous.fetched if k not in found}
+        else:
+            empty = set()
+
+        def _priority(query: PlannedQuery) -> tuple[int, float]:
+            route = (query.collector.__name__, tuple((leg.origin, leg.destination) for leg in query.search.legs))
+            if route in best:
+                return 0, best[route]
+            return (2, 0.0) if query.key() in empty else (1, 0.0)
+
+        return sorted(queries, key=_priority)
+
+
+class BudgetClock:
+    # The running state of a QueryBudget; shared by the workers of one run
+
+    def __init__(self, expires: float | None, max_calls: int | None):
+        self.expires = expires
+        self.max_calls = max_calls
+        self.calls = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def take(self, calls: int = 1) -> bool:
+        # Reserves `calls` provider requests if there's time and calls left for them
+        with self._lock:
+            if self.expired or (self.max_calls is not None and self.calls + calls > self.max_calls):
+                self.refused += 1
+                return False
+            self.calls += calls
+            return True
+
+    def __str__(self) -> str:
+        limit = "" if self.max_calls is None else f"/{self.max_calls}"
+        remaining = "" if self.expires is None else f", {max(0.0, self.expires - time.monotonic()):.0f}s left"
+        return f"{self.calls}{limit} provider calls used{remaining}"
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import deque
+from typing import Iterable, Iterator, Callable, Coroutine, Mapping, TypeVar, Any
+
+from FlightCollector import FlightCollector, AsyncFlightCollector, FetchUnit
+from FlightCollector.EventLoop import BackgroundLoop
+from Planner.Query import PlannedQuery
+
+T = TypeVar("T")
+Q = TypeVar("Q", PlannedQuery, FetchUnit)
+
+
+#
+
+
+class QueryExecutor:
+    # Runs queries on a thread pool without exceeding any collector's concurrency cap.  Queries for
+    # async collectors are run on the shared event loop instead and don't occupy a worker.  Results
+    # are handed back in the order the queries were given, so ranking sees what a sequential run would.
+
+    def __init__(self, workers: int, limits: Mapping[type[FlightCollector], int] | None = None):
+        self.workers = max(1, workers)
+        self.limits = dict(limits or {})
+
+    def limit(self, collector: type[FlightCollector]) -> int:
+        return max(1, self.limits.get(collector, collector.MAX_CONCURRENCY))
+
+    def run(self, queries: Iterable[Q],
+            task: Callable[[Q], T],
+            async_task: Callable[[Q], Coroutine[Any, Any, T]] | None = None) -> Iterator[T]:
+        def _is_async(collector: type[FlightCollector]) -> bool:
+            return async_task is not None and issubclass(collector, AsyncFlightCollector)
+
+        if self.workers == 1:
+            for q in queries:
+                yield BackgroundLoop.shared().run(async_task(q)) if _is_async(q.collector) else task(q)
+            return
+
+        pending: dict[type[FlightCollector], deque[tuple[int, Q]]] = {}
+        total = 0
+        for i, query in enumerate(queries):
+            pending.setdefault(query.collector, deque()).append((i, query))
+            total += 1
+
+        for collector in pending:
+            collector.set_concurrency(self.limit(collector))
+
+        running: dict[Future, type[FlightCollector]] = {}
+        threads = 0
+        active: dict[type[FlightCollector], int] = {c: 0 for c in pending}
+        done: dict[int, T] = {}
+        next_index = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            def _fill():
+                nonlocal threads
+                for collector, queue in pending.items():
+                    is_async = _is_async(collector)
+                    while queue and active[collector] < self.limit(collector) and \
+                            (is_async or threads < self.workers):
+                        i, query = queue.popleft()
+                        if is_async:
+                            future = BackgroundLoop.shared().submit(async_task(query))
+                        else:
+                            future = pool.submit(task, query)
+                            threads += 1
+                        future.index = i
+                        running[future] = collector
+                        active[collector] += 1
+
+            _fill()
+            while next_index < total:
+                finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collector = running.pop(future)
+                    active[collector] -= 1
+                    if not _is_async(collector):
+                        threads -= 1
+                    done[future.index] = future.result()
+                _fill()
+                while next_index in done:
+                    yield done.pop(next_index)
+                    next_index += 1
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+from FlightCollector import FlightCollector, FetchUnit
+from Planner.Query import PlannedQuery
+
+
+#
+
+
+class FetchPlan:
+    # The distinct provider requests behind a set of queries.  Searches from different options
+    # (or different legs of the same search) often need the same request; it only appears here once.
+
+    def __init__(self, queries: Iterable[PlannedQuery] = ()):
+        self.units: dict[str, FetchUnit] = {}
+        self.requested: dict[type[FlightCollector], int] = {}
+        for query in queries:
+            self.add(query)
+
+    def add(self, query: PlannedQuery):
+        units = query.collector.fetch_units(query.search)
+        self.requested[query.collector] = self.requested.get(query.collector, 0) + len(units)
+        for unit in units:
+            self.units.setdefault(unit.key, unit)
+
+    def unique(self, collector: type[FlightCollector] | None = None) -> int:
+        return sum(1 for u in self.units.values() if collector is None or u.collector is collector)
+
+    @property
+    def saved(self) -> int:
+        return sum(self.requested.values()) - len(self.units)
+
+    def report(self) -> dict[str, dict[str, int]]:
+        return {c.__name__: {"requested": requested,
+                             "unique": (unique := self.unique(c)),
+                             "saved": requested - unique}
+                for c, requested in self.requested.items()}
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def __str__(self) -> str:
+        lines = [f"Fetch plan: {len(self)} unique fetches for {sum(self.requested.values())} requested "
+                 f"({self.saved} saved)"]
+        for name, counts in self.report().items():
+            if counts["requested"] > 0:
+                lines.append(f"  {name}: {counts['unique']}/{counts['requested']} ({counts['saved']} saved)")
+        return "\n".join(lines)
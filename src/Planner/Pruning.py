@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+from SprelfJSON import JSONModel
+from abc import ABC, abstractmethod
+from typing import Sequence
+import numpy as np
+
+from Data import TripBatch
+from Planner.Query import QueryResult
+
+
+#
+
+
+class PruneObjective(JSONModel, ABC):
+    # A per-trip value to minimize
+
+    @abstractmethod
+    def values(self, batch: TripBatch) -> np.ndarray:
+        ...
+
+    @classmethod
+    def _per_trip(cls, batch: TripBatch, column: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(column, batch.trip_starts).astype(float)
+
+
+class PriceObjective(PruneObjective):
+
+    def values(self, batch: TripBatch) -> np.ndarray:
+        return self._per_trip(batch, batch.cheapest)
+
+
+class DurationObjective(PruneObjective):
+
+    def values(self, batch: TripBatch) -> np.ndarray:
+        return self._per_trip(batch, batch.duration)
+
+
+class LayoverObjective(PruneObjective):
+
+    def values(self, batch: TripBatch) -> np.ndarray:
+        return self._per_trip(batch, batch.stops)
+
+
+#
+
+
+class Pruner(JSONModel, ABC):
+
+    @abstractmethod
+    def prune(self, results: Sequence[QueryResult]) -> list[QueryResult]:
+        ...
+
+
+class ParetoPruner(Pruner):
+    # Drops trips that another trip of the same currency dominates: no worse on every objective and
+    # better on at least one.  With `epsilon` set, the other trip's values are first scaled up by
+    # that fraction, so trips within the margin of the frontier are kept as well.  The margin is
+    # relative, so an objective where both are zero (e.g. nonstop on layovers) counts as a tie and
+    # doesn't protect a trip that's beaten by the margin on the rest.
+    objectives: list[PruneObjective] = [PriceObjective(), DurationObjective(), LayoverObjective()]
+    epsilon: float = 0.0
+
+    _CHUNK_SIZE: int = 512
+
+    def prune(self, results: Sequence[QueryResult]) -> list[QueryResult]:
+        results = list(results)
+        if len(results) < 2 or not self.objectives:
+            return results
+        batch = TripBatch(r.trip for r in results)
+        points = np.column_stack([o.values(batch) for o in self.objectives])
+        currencies = batch.currency[batch.trip_starts]
+        keep = np.zeros(len(results), dtype=bool)
+        for currency in set(currencies.tolist()):
+            group = np.nonzero(currencies == currency)[0]
+            keep[group[self._kept(points[group])]] = True
+        return [r for r, k in zip(results, keep) if k]
+
+    def _kept(self, points: np.ndarray) -> np.ndarray:
+        frontier = self.frontier(points)
+        if self.epsilon <= 0:
+            return frontier
+        # Anything beaten by a margin is also beaten by a margin by some frontier trip
+        scaled = points[frontier] * (1 + self.epsilon)
+        return np.array([i for start in range(0, len(points), self._CHUNK_SIZE)
+                         for i in self._undominated(points[start:start + self._CHUNK_SIZE], scaled, start)],
+                        dtype=np.intp)
+
+    @classmethod
+    def frontier(cls, points: np.ndarray) -> np.ndarray:
+        # Sort-filter skyline: in lexicographic order a point can only be dominated by one before it,
+        # so each chunk is checked against the frontier so far and then against its own survivors.
+        # Returns the indices of the non-dominated points, equal points all kept.
+        order = np.lexsort(points.T[::-1])
+        front = np.empty((0, points.shape[1]))
+        kept: list[int] = []
+        for start in range(0, len(order), cls._CHUNK_SIZE):
+            chunk = order[start:start + cls._CHUNK_SIZE]
+            for i in cls._undominated(points[chunk], front, 0):
+                p = points[chunk[i]]
+                if len(front) and np.any(np.all(front <= p, axis=1) & np.any(front < p, axis=1)):
+                    continue
+                front = np.vstack((front, p))
+                kept.append(int(chunk[i]))
+        return np.sort(np.array(kept, dtype=np.intp))
+
+    @classmethod
+    def _undominated(cls, chunk: np.ndarray, front: np.ndarray, offset: int) -> np.ndarray:
+        if len(front) == 0:
+            return np.arange(len(chunk)) + offset
+        le = np.all(front[None, :, :] <= chunk[:, None, :], axis=2)
+        lt = np.any(front[None, :, :] < chunk[:, None, :], axis=2)
+        return np.nonzero(~np.any(le & lt, axis=1))[0] + offset
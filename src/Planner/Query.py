@@ -1,9 +1,13 @@
 from __future__ import annotations
 
 from SprelfJSON import JSONModel
+from datetime import date, datetime
+import hashlib
+import json
 
 from Data import Flight, FlightSearch, Trip
 from FlightCollector.FlightCollector import FlightCollector
+from FlightCollector.Cache import FetchCache
 
 
 #
@@ -14,10 +18,22 @@ class PlannedQuery(JSONModel):
     collector: type[FlightCollector]
     search: FlightSearch
 
+    def key(self) -> str:
+        # Stable across runs; the digest covers everything else in the search (filters, limit, ...)
+        digest = hashlib.sha1(json.dumps(self.search.to_json(), sort_keys=True, default=str).encode())
+        return FetchCache.key(self.collector.__name__, self.search.seat, self.search.passengers,
+                              *((leg.origin, leg.destination, leg.date) for leg in self.search.legs),
+                              digest.hexdigest()[:12])
+
+    @property
+    def departure(self) -> date:
+        return self.search.legs[0].date
+
 
 class QueryResult(JSONModel):
     collector: type[FlightCollector]
     trip: Trip
+    key: str | None = None  # key of the PlannedQuery this came from
 
 
 class ScoreInfo(JSONModel):
@@ -54,3 +70,11 @@ class ScoredQueryResult(JSONModel):
                  f"    {f.cheapest():.0f} {f.currency}, {'|'.join(s.name for s in f.seats())}, {'/'.join(h.airline for h in f.hops)}\n" \
                  f"    {' -> '.join(f.stops())}\n\n"
         return s
+
+
+class PlanResult(JSONModel):
+    name: str
+    results: list[ScoredQueryResult]
+    fetched: dict[str, datetime] = {}  # query key -> when its results were fetched
+    skipped: list[str] = []  # keys of stale queries left out when the plan's budget ran out
+    failed: list[str] = []  # keys of stale queries whose collection failed; their previous results were kept
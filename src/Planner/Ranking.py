@@ -2,25 +2,41 @@ from __future__ import annotations
 
 from SprelfJSON import JSONModel
 from abc import ABC, abstractmethod
-from typing import Iterable, Callable, Collection
-from datetime import datetime, date, time, timedelta
+from typing import Iterable, Sequence, Mapping
+from datetime import datetime
+import itertools
+import heapq
+import numpy as np
 
 from Planner.Query import QueryResult, ScoredQueryResult, ScoreInfo
-from Data.Flight import Flight, Trip
+from Data.Flight import Flight
+from FlightCollector.Metrics import Metrics
 
 
 class Ranker(JSONModel, ABC):
 
-    def rank(self, results: Iterable[QueryResult]) -> list[ScoredQueryResult]:
-        results = list(self._score(list(results)))
+    def rank(self, results: Iterable[QueryResult], top_k: int | None = None,
+             bounds: Mapping[str, tuple[float, float]] | None = None) -> list[ScoredQueryResult]:
+        with Metrics.timed("rank", ranker=type(self).__name__):
+            if top_k is None:
+                scored = sorted(self._score(list(results)), key=lambda x: x[1], reverse=True)
+            else:
+                scored = self._top_k(results, top_k, bounds)
         return [
             ScoredQueryResult(query=qr, score=s, rank=i)
-            for i, (qr, s) in enumerate(sorted(results, key=lambda x: x[1], reverse=True))]
+            for i, (qr, s) in enumerate(scored)]
 
     @abstractmethod
     def _score(self, flights: Iterable[QueryResult]) -> list[tuple[QueryResult, ScoreInfo]]:
         ...
 
+    def _top_k(self, results: Iterable[QueryResult], top_k: int,
+               bounds: Mapping[str, tuple[float, float]] | None) -> list[tuple[QueryResult, ScoreInfo]]:
+        # Ties keep their input order, as the stable sort in the full ranking does
+        best = heapq.nlargest(top_k, enumerate(self._score(list(results))),
+                              key=lambda x: (x[1][1].score, -x[0]))
+        return [scored for _, scored in best]
+
 
 #
 
@@ -45,14 +61,26 @@ class RankProperty(JSONModel, ABC):
             v *= -1
         if self._range[0] is None or v < self._range[0]:
             self._range = (v, self._range[1])
-        elif self._range[1] is None or v > self._range[1]:
+        if self._range[1] is None or v > self._range[1]:
             self._range = (self._range[0], v)
         return v
 
+    def apply_many(self, flights: Sequence[Flight], **kwargs) -> np.ndarray:
+        v = np.asarray(self._apply_many(flights, **kwargs), dtype=float)
+        if self.inverted:
+            v = -v
+        if len(v) > 0:
+            self._range = (float(v.min()), float(v.max()))
+        return v
+
     @abstractmethod
     def _apply(self, flight: Flight, **kwargs) -> float:
         ...
 
+    def _apply_many(self, flights: Sequence[Flight], **kwargs) -> np.ndarray:
+        # Override to score a whole column at once; the default defers to _apply per flight
+        return np.fromiter((self._apply(f, **kwargs) for f in flights), dtype=float, count=len(flights))
+
     def normalize(self, value: float, **kwargs) -> float:
         if self._range[0] is None or self._range[1] is None:
             return value
@@ -60,9 +88,21 @@ class RankProperty(JSONModel, ABC):
             return 0
         return (value - self._range[0]) / (self._range[1] - self._range[0])
 
+    def normalize_many(self, values: np.ndarray, **kwargs) -> np.ndarray:
+        if type(self).normalize is not RankProperty.normalize:
+            return np.fromiter((self.normalize(v, **kwargs) for v in values), dtype=float, count=len(values))
+        if self._range[0] is None or self._range[1] is None:
+            return values
+        if self._range[0] == self._range[1]:
+            return np.zeros_like(values)
+        return (values - self._range[0]) / (self._range[1] - self._range[0])
+
     def reset(self):
         self._range = (None, None)
 
+    def set_range(self, low: float, high: float):
+        self._range = (low, high)
+
 
 #
 
@@ -76,35 +116,106 @@ class StandardRanker(Ranker):
             raise ValueError("StandardRanker must have at least one ranking property")
 
     def _score(self, trips: list[QueryResult]) -> Iterable[tuple[QueryResult, ScoreInfo]]:
-        scores: list[list[list[float]]] = []  # props[trips[flights[score]]]
+        if len(trips) == 0:
+            return
+        props = list(self.properties)
+        values, counts, starts = self._values(trips, props)
+        scores = self._reduce(values, counts, starts, props, self._ranges(values))
+        finals = self._finals(scores, props)
+        for trip, trip_score, final in zip(trips, scores.tolist(), finals.tolist()):
+            yield trip, self._info(trip_score, final, props)
+
+    def _top_k(self, results: Iterable[QueryResult], top_k: int,
+               bounds: Mapping[str, tuple[float, float]] | None) -> list[tuple[QueryResult, ScoreInfo]]:
+        if top_k <= 0:
+            return []
+        props = list(self.properties)
+        if bounds is None:
+            # Ranges need every value first, so score everything but only build the survivors
+            trips = list(results)
+            if len(trips) == 0:
+                return []
+            values, counts, starts = self._values(trips, props)
+            scores = self._reduce(values, counts, starts, props, self._ranges(values))
+            finals = self._finals(scores, props)
+            order = np.lexsort((np.arange(len(finals)), -finals))[:top_k]
+            return [(trips[i], self._info(scores[i].tolist(), float(finals[i]), props)) for i in order]
+
+        ranges = [self._bounds(prop, bounds) for prop in props]
+        heap: list[tuple[float, int, list[float], QueryResult]] = []
+        iterator = iter(results)
+        offset = 0
+        while chunk := list(itertools.islice(iterator, self._CHUNK_SIZE)):
+            values, counts, starts = self._values(chunk, props)
+            scores = self._reduce(values, counts, starts, props, ranges)
+            finals = self._finals(scores, props)
+            candidates = range(len(chunk)) if len(heap) < top_k else np.nonzero(finals > heap[0][0])[0]
+            for i in candidates:
+                item = (float(finals[i]), -(offset + int(i)), scores[i].tolist(), chunk[i])
+                if len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                elif item[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, item)
+            offset += len(chunk)
+
+        return [(qr, self._info(row, final, props))
+                for final, _, row, qr in sorted(heap, key=lambda x: x[:2], reverse=True)]
+
+    #
+
+    _CHUNK_SIZE: int = 4096
 
-        for prop in self.properties:
-            scores.append([[prop.apply(flight) for flight in trip.trip.flights]
-                           for trip in trips])
-            scores[-1] = [[prop.normalize(v) for v in row] for row in scores[-1]]
+    @classmethod
+    def _values(cls, trips: Sequence[QueryResult],
+                props: list[RankProperty]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        flights = [flight for trip in trips for flight in trip.trip.flights]
+        counts = np.fromiter((len(trip.trip.flights) for trip in trips), dtype=np.intp, count=len(trips))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        values = np.empty((len(flights), len(props)))  # flights[props[value]]
+        for i, prop in enumerate(props):
+            values[:, i] = prop.apply_many(flights)
             prop.reset()
+        return values, counts, starts
 
-        reduced = [[sum(scores) / len(scores) for scores in row] for row in scores]  # props[trips[score]]
-        transposed = self._transpose(reduced)  # trips[props[score]]
-        for trip, trip_score in zip(trips, transposed):
-            final = (sum(s * prop.weight for s, prop in zip(trip_score, self.properties))
-                     / sum(prop.weight for prop in self.properties))
-            details = {
-                "breakdown": [
-                    {
-                        "prop": type(p).__name__,
-                        "val": s,
-                    }
-                     for s, p in zip(trip_score, self.properties)
-                ]
-            }
-            yield trip, ScoreInfo(score=final, details=details)
+    @classmethod
+    def _ranges(cls, values: np.ndarray) -> list[tuple[float, float]]:
+        return list(zip(values.min(axis=0).tolist(), values.max(axis=0).tolist()))
 
-    #
+    @classmethod
+    def _bounds(cls, prop: RankProperty, bounds: Mapping[str, tuple[float, float]]) -> tuple[float, float]:
+        name = type(prop).__name__
+        if name not in bounds:
+            raise ValueError(f"No bounds given for ranking property '{name}'")
+        low, high = bounds[name]
+        return (-high, -low) if prop.inverted else (low, high)
 
     @classmethod
-    def _transpose(cls, matrix: list[list[float]]) -> list[list[float]]:
-        return [list(r) for r in zip(*matrix)]
+    def _reduce(cls, values: np.ndarray, counts: np.ndarray, starts: np.ndarray,
+                props: list[RankProperty], ranges: list[tuple[float, float]]) -> np.ndarray:
+        scores = np.empty((len(counts), len(props)))  # trips[props[score]]
+        for i, (prop, (low, high)) in enumerate(zip(props, ranges)):
+            prop.set_range(low, high)
+            scores[:, i] = np.add.reduceat(prop.normalize_many(values[:, i]), starts) / counts
+            prop.reset()
+        return scores
+
+    @classmethod
+    def _finals(cls, scores: np.ndarray, props: list[RankProperty]) -> np.ndarray:
+        weights = np.array([prop.weight for prop in props], dtype=float)
+        return (scores * weights).sum(axis=1) / sum(prop.weight for prop in props)
+
+    @classmethod
+    def _info(cls, trip_score: list[float], final: float, props: list[RankProperty]) -> ScoreInfo:
+        details = {
+            "breakdown": [
+                {
+                    "prop": type(p).__name__,
+                    "val": s,
+                }
+                for s, p in zip(trip_score, props)
+            ]
+        }
+        return ScoreInfo(score=final, details=details)
 
 
 #
@@ -124,6 +235,12 @@ class AirlineRankProperty(RankProperty):
             v -= 1
         return v
 
+    def _apply_many(self, flights: Sequence[Flight], **kwargs) -> np.ndarray:
+        preferred, disliked = set(self.preferred_airlines), set(self.disliked_airlines)
+        return np.fromiter((bool(preferred.intersection(h.airline for h in f.hops)) -
+                            bool(disliked.intersection(h.airline for h in f.hops))
+                            for f in flights), dtype=float, count=len(flights))
+
 
 class PriceRankProperty(RankProperty):
     inverted: bool = True
@@ -131,6 +248,9 @@ class PriceRankProperty(RankProperty):
     def _apply(self, flight: Flight, **kwargs) -> float:
         return flight.cheapest()
 
+    def _apply_many(self, flights: Sequence[Flight], **kwargs) -> np.ndarray:
+        return np.fromiter((f.cheapest() for f in flights), dtype=float, count=len(flights))
+
 
 class DurationRankProperty(RankProperty):
     inverted: bool = True
@@ -138,6 +258,9 @@ class DurationRankProperty(RankProperty):
     def _apply(self, flight: Flight, **kwargs) -> float:
         return flight.duration.total_seconds() / 60
 
+    def _apply_many(self, flights: Sequence[Flight], **kwargs) -> np.ndarray:
+        return np.fromiter((f.duration.total_seconds() for f in flights), dtype=float, count=len(flights)) / 60
+
 
 class LayoverRankProperty(RankProperty):
     inverted: bool = True
@@ -145,6 +268,9 @@ class LayoverRankProperty(RankProperty):
     def _apply(self, flight: Flight, **kwargs) -> float:
         return len(flight.layovers)
 
+    def _apply_many(self, flights: Sequence[Flight], **kwargs) -> np.ndarray:
+        return np.fromiter((len(f.hops) for f in flights), dtype=float, count=len(flights)) - 1
+
 
 class TimeRangeRankProperty(RankProperty):
     class TimeRangeRank(JSONModel):
@@ -166,6 +292,25 @@ class TimeRangeRankProperty(RankProperty):
         return sum((_time_score(flight.departure_time),
                     _time_score(flight.arrival_time))) / 2
 
+    def _apply_many(self, flights: Sequence[Flight], **kwargs) -> np.ndarray:
+        def _time_scores(hours: np.ndarray) -> np.ndarray:
+            result = np.zeros(len(hours))
+            matched = np.zeros(len(hours), dtype=bool)
+            for tr in self.time_ranges:
+                if tr.start < tr.end:
+                    hit = (tr.start <= hours) & (hours < tr.end)
+                elif tr.start > tr.end:
+                    hit = (hours <= tr.start) | (hours < tr.end)
+                else:
+                    continue
+                result[hit & ~matched] = tr.value
+                matched |= hit
+            return result
+
+        departures = np.fromiter((f.departure_time.hour for f in flights), dtype=int, count=len(flights))
+        arrivals = np.fromiter((f.arrival_time.hour for f in flights), dtype=int, count=len(flights))
+        return (_time_scores(departures) + _time_scores(arrivals)) / 2
+
 
 class StopRankProperty(RankProperty):
     stop_values: dict[str, int] = {}
@@ -175,6 +320,10 @@ class StopRankProperty(RankProperty):
                    for stop, value in self.stop_values.items()
                    if stop in flight.stops())
 
+    def _apply_many(self, flights: Sequence[Flight], **kwargs) -> np.ndarray:
+        return np.fromiter((sum(self.stop_values.get(stop, 0) for stop in set(f.stops())) for f in flights),
+                           dtype=float, count=len(flights))
+
 
 #
 
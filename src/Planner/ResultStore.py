@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from typing import Iterable, Iterator, BinaryIO
+from datetime import datetime
+import numpy as np
+import struct
+import json
+import zlib
+import mmap
+import os
+
+from ruamel.yaml import YAML
+
+from Planner.Query import ScoredQueryResult, PlanResult
+from Planner.Sink import JSONLinesSink
+
+# Layout: header, then for every PlanResult its score/rank/price columns followed by its rows in
+# zlib-compressed JSON blocks of BLOCK_ROWS, then a JSON index of where everything is, then a
+# trailer pointing at the index.  Columns are read straight out of the memory map and rows are
+# only decompressed for the blocks that are asked for.
+MAGIC = b"FLRS"
+VERSION = 1
+BLOCK_ROWS = 256
+_HEADER = struct.Struct("<4sI")
+_TRAILER = struct.Struct("<Q4s")
+_COLUMNS = {"score": np.float64, "rank": np.int64, "price": np.float64}
+
+
+#
+
+
+def write_results(path: str, results: Iterable[PlanResult], block_rows: int = BLOCK_ROWS):
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION))
+        index = {"block_rows": block_rows, "groups": [_write_group(f, pr, block_rows) for pr in results]}
+        offset = f.tell()
+        f.write(json.dumps(index).encode("utf-8"))
+        f.write(_TRAILER.pack(offset, MAGIC))
+
+
+def _write_group(f: BinaryIO, result: PlanResult, block_rows: int) -> dict:
+    rows = result.results
+    entry = {"name": result.name,
+             "fetched": {k: v.isoformat() for k, v in result.fetched.items()},
+             "skipped": list(result.skipped),
+             "failed": list(result.failed),
+             "count": len(rows),
+             "columns": {}}
+    columns = {"score": (r.score.score for r in rows),
+               "rank": (r.rank for r in rows),
+               "price": (r.query.trip.cheapest() for r in rows)}
+    for name, values in columns.items():
+        data = np.fromiter(values, dtype=_COLUMNS[name], count=len(rows))
+        _align(f)
+        entry["columns"][name] = f.tell()
+        f.write(data.tobytes())
+
+    blocks = []
+    for start in range(0, len(rows), block_rows):
+        blob = zlib.compress(json.dumps([r.to_json() for r in rows[start:start + block_rows]],
+                                        separators=(",", ":")).encode("utf-8"))
+        blocks.append((f.tell(), len(blob)))
+        f.write(blob)
+    entry["blocks"] = blocks
+    return entry
+
+
+def _align(f: BinaryIO):
+    if pad := -f.tell() % 8:
+        f.write(b"\0" * pad)
+
+
+#
+
+
+class ResultFile:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack_from(self._map, 0)
+        offset, end_magic = _TRAILER.unpack_from(self._map, len(self._map) - _TRAILER.size)
+        if magic != MAGIC or end_magic != MAGIC:
+            raise ValueError(f"{path} is not a results file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported results file version {version}")
+        index = json.loads(self._map[offset:len(self._map) - _TRAILER.size])
+        self.block_rows: int = index["block_rows"]
+        self._groups: dict[str, dict] = {g["name"]: g for g in index["groups"]}
+
+    @property
+    def names(self) -> list[str]:
+        return list(self._groups)
+
+    def count(self, name: str) -> int:
+        return self._groups[name]["count"]
+
+    def column(self, name: str, column: str) -> np.ndarray:
+        # Read-only view into the file, nothing is copied
+        group = self._groups[name]
+        return np.frombuffer(self._map, dtype=_COLUMNS[column], count=group["count"],
+                             offset=group["columns"][column])
+
+    def scores(self, name: str) -> np.ndarray:
+        return self.column(name, "score")
+
+    def ranks(self, name: str) -> np.ndarray:
+        return self.column(name, "rank")
+
+    def prices(self, name: str) -> np.ndarray:
+        return self.column(name, "price")
+
+    def rows(self, name: str, start: int = 0, stop: int | None = None) -> Iterator[ScoredQueryResult]:
+        group = self._groups[name]
+        stop = group["count"] if stop is None else min(stop, group["count"])
+        for b in range(start // self.block_rows, -(-stop // self.block_rows)):
+            offset, size = group["blocks"][b]
+            block = json.loads(zlib.decompress(self._map[offset:offset + size]))
+            first = b * self.block_rows
+            for row in block[max(0, start - first):stop - first]:
+                yield ScoredQueryResult.from_json(row)
+
+    def top(self, name: str, n: int) -> list[ScoredQueryResult]:
+        return list(self.rows(name, 0, n))
+
+    def group(self, name: str, limit: int | None = None) -> PlanResult:
+        group = self._groups[name]
+        return PlanResult(name=name, results=list(self.rows(name, 0, limit)),
+                          fetched={k: datetime.fromisoformat(v) for k, v in group["fetched"].items()},
+                          skipped=group.get("skipped", []),
+                          failed=group.get("failed", []))
+
+    def load(self, limit: int | None = None) -> list[PlanResult]:
+        return [self.group(name, limit) for name in self._groups]
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # columns handed out still point into the map; it's released along with them
+        self._file.close()
+
+    def __enter__(self) -> ResultFile:
+        return self
+
+    def __exit__(self, *_) -> bool:
+        self.close()
+        return False
+
+
+#
+
+
+def _yaml() -> YAML:
+    yaml = YAML(typ="safe")
+    yaml.allow_unicode = True
+    yaml.default_flow_style = False
+    yaml.indent(mapping=2, sequence=4, offset=2)
+    return yaml
+
+
+def load_results(path: str) -> list[PlanResult]:
+    # Any format, going by the extension
+    ext = os.path.splitext(path)[1]
+    if ext in (".yaml", ".yml"):
+        with open(path, "r", encoding="utf-8") as f:
+            return [PlanResult.from_json(group) for group in _yaml().load(f)["results"]]
+    if ext == ".jsonl":
+        return JSONLinesSink.load(path)
+    with ResultFile(path) as rf:
+        return rf.load()
+
+
+def yaml_to_results(yaml_path: str, path: str):
+    write_results(path, load_results(yaml_path))
+
+
+def results_to_yaml(path: str, yaml_path: str):
+    with open(yaml_path, "w", encoding="utf-8") as f:
+        _yaml().dump({"results": [pr.to_json() for pr in load_results(path)]}, f)
@@ -3,26 +3,35 @@ from __future__ import annotations
 from SprelfJSON import JSONModel
 from abc import ABC, abstractmethod
 from typing import Iterable
+from datetime import datetime, timezone
+import itertools
+import time
 
-from Data import FlightOptions, Flight, FlightSearch, SeatType
-from FlightCollector import FlightCollector
-from Planner.Query import PlannedQuery, QueryResult, ScoredQueryResult
+from Data import FlightOptions, Flight, FlightSearch, SeatType, Trip, SearchFilter
+from FlightCollector import FlightCollector, FetchUnit, FetchMemo, TTLPolicy, Metrics, CollectorPool
+from Planner.Query import PlannedQuery, QueryResult, ScoredQueryResult, PlanResult
+from Planner.Sink import ResultSink
 from Planner.Restrictions import SearchRestriction
 from Planner.Ranking import Ranker, DefaultRanker
+from Planner.Pruning import Pruner
+from Planner.Budget import QueryBudget, BudgetClock
+from Planner.Executor import QueryExecutor
+from Planner.FetchPlan import FetchPlan
 
 
 #
 
-class PlanResult(JSONModel):
-    name: str
-    results: list[ScoredQueryResult]
-
-
 class SearchPlan(JSONModel):
     options: list[FlightOptions]
     collectors: list[type[FlightCollector]]
     restrictions: list[SearchRestriction] = []
     ranker: Ranker = DefaultRanker()
+    pruner: Pruner | None = None
+    top_k: int | None = None
+    workers: int = 1
+    concurrency: dict[str, int] = {}
+    staleness: TTLPolicy = TTLPolicy()
+    budget: QueryBudget | None = None
 
     def queries(self, options: FlightOptions) -> Iterable[PlannedQuery]:
         for collector in self.collectors:
@@ -32,17 +41,203 @@ class SearchPlan(JSONModel):
                                                      *self.restrictions):
                         yield pq
 
-    def search(self) -> Iterable[PlanResult]:
-        for fo in self.options:
-            yield PlanResult(name=fo.name, results=list(self._rank(self._search_for_options(fo))))
+    def fetch_plan(self) -> FetchPlan:
+        return FetchPlan(q for fo in self.options for q in self.queries(fo))
+
+    def search(self, sink: ResultSink | None = None) -> Iterable[PlanResult]:
+        return self.refresh([], sink=sink)
+
+    def refresh(self, previous: Iterable[PlanResult], now: datetime | None = None,
+                sink: ResultSink | None = None) -> Iterable[PlanResult]:
+        # Only re-runs the queries whose previous results are missing or older than the staleness
+        # policy allows for their departure date; everything else is carried over and re-ranked
+        # together with the fresh results.  Previous results are only what survived their own
+        # ranking, so with `top_k` set a retained query contributes at most its old top-K trips.
+        # With a budget, the stale queries are run most promising first, and the ones it doesn't
+        # stretch to keep their previous results (if any) and are listed in PlanResult.skipped.
+        # Queries whose collection fails are treated the same way and listed in PlanResult.failed,
+        # so a transient error doesn't wipe out good results or count as a fresh fetch.
+        # Stale queries that were fetched before skip the collectors' caches, whose own TTLs know
+        # nothing of `staleness`, and a query's fetch time is only set when its provider requests
+        # were actually made (or its collector doesn't declare them).
+        # Collectors are initialized once per worker and reused for the whole run, or for as long as
+        # the caller keeps a CollectorPool active.
+        now = now or datetime.now(timezone.utc)
+        previous = {pr.name: pr for pr in previous}
+        queries = {fo.name: list(self.queries(fo)) for fo in self.options}
+        stale = {name: [q for q in qs if self._is_stale(q, previous.get(name), now)]
+                 for name, qs in queries.items()}
+        expired = {u.key for name, qs in stale.items() for q in qs
+                   if (pr := previous.get(name)) is not None and q.key() in pr.fetched
+                   for u in q.collector.fetch_units(q.search)}
+
+        budget: BudgetClock | None = None
+        if self.budget is not None:
+            budget = self.budget.start()
+            stale = {name: self.budget.prioritize(qs, previous.get(name)) for name, qs in stale.items()}
+        plan = FetchPlan(self._interleave(list(stale.values())))
+        for name, counts in plan.report().items():
+            Metrics.count(f"{name}.fetches.requested", counts["requested"])
+            Metrics.count(f"{name}.fetches.unique", counts["unique"])
+        Metrics.count("queries.planned", sum(len(qs) for qs in queries.values()))
+        Metrics.count("queries.stale", sum(len(qs) for qs in stale.values()))
+        with FetchMemo.activate(bypass=expired) as memo, CollectorPool.activate():
+            with Metrics.timed("prefetch"):
+                done = self._prefetch(plan, budget)
+            Metrics.snapshot("prefetch")
+            for fo in self.options:
+                skipped = {q.key() for q in stale[fo.name]
+                           if any(u.key not in done for u in q.collector.fetch_units(q.search))}
+                failed: set[str] = set()
+                found = list(self._search_for_options(fo, [q for q in stale[fo.name] if q.key() not in skipped],
+                                                      now, sink, budget, skipped, failed))
+                fetched = {q.key(): now for q in stale[fo.name]
+                           if q.key() not in skipped and q.key() not in failed and self._provided(q, memo)}
+                retained: list[QueryResult] = []
+                if (pr := previous.get(fo.name)) is not None:
+                    keep = {k for k in (q.key() for q in queries[fo.name]) if k not in fetched and k in pr.fetched}
+                    fetched.update({k: pr.fetched[k] for k in keep})
+                    retained = [sqr.query for sqr in pr.results if sqr.query.key in keep]
+                result = PlanResult(name=fo.name,
+                                    results=list(self._rank([*retained, *found])),
+                                    fetched=fetched,
+                                    skipped=[q.key() for q in stale[fo.name] if q.key() in skipped],
+                                    failed=[q.key() for q in stale[fo.name] if q.key() in failed])
+                if skipped:
+                    print(f"Budget ran out for \"{fo.name}\": skipped {len(skipped)} of {len(stale[fo.name])} "
+                          f"queries ({budget})")
+                    Metrics.count("queries.skipped", len(skipped))
+                if failed:
+                    print(f"{len(failed)} of {len(stale[fo.name])} queries failed for \"{fo.name}\"; "
+                          f"their previous results were kept")
+                    Metrics.count("queries.failed", len(failed))
+                if sink is not None:
+                    sink.write_plan(result)
+                Metrics.snapshot(fo.name)
+                yield result
+
+    @classmethod
+    def _interleave(cls, queues: list[list[PlannedQuery]]) -> Iterable[PlannedQuery]:
+        # Round-robin over the options, so a tight budget isn't all spent on the first one
+        for round_ in itertools.zip_longest(*queues):
+            yield from (q for q in round_ if q is not None)
+
+    def _is_stale(self, query: PlannedQuery, previous: PlanResult | None, now: datetime) -> bool:
+        if previous is None or (fetched := previous.fetched.get(query.key())) is None:
+            return True
+        return now - fetched >= self.staleness.ttl(query.departure, now)
+
+    @classmethod
+    def _provided(cls, query: PlannedQuery, memo: FetchMemo) -> bool:
+        # Whether the query's data came from its provider in this run rather than from a cache
+        return all(u.key in memo.provided for u in query.collector.fetch_units(query.search))
+
+    def executor(self) -> QueryExecutor:
+        return QueryExecutor(workers=self.workers,
+                             limits={c: self.concurrency[c.__name__] for c in self.collectors
+                                     if c.__name__ in self.concurrency})
 
-    def _search_for_options(self, options: FlightOptions) -> Iterable[QueryResult]:
-        for query in self.queries(options):
-            with query.collector() as collector:
-                trips = collector.collect(query.search)
-                yield from (QueryResult(collector=query.collector, trip=t) for t in trips
-                            if all(filt.filter(flight) for filt in options.filters for flight in t.flights))
+    def _prefetch(self, plan: FetchPlan, budget: BudgetClock | None = None) -> set[str]:
+        # Runs every distinct fetch once up front, so the searches that follow are served from the
+        # active FetchMemo.  Failures are remembered there and surface in the search that needs them.
+        # Returns the keys of the units that were run, which is all of them unless the budget ran out.
+        done: set[str] = set()
 
+        def _allowed(unit: FetchUnit) -> bool:
+            return budget is None or unit.collector.is_cached(unit.key) or budget.take()
+
+        def _run(unit: FetchUnit):
+            if not _allowed(unit):
+                return
+            done.add(unit.key)
+            try:
+                with CollectorPool.lease(unit.collector) as collector:
+                    collector.fetch_unit(unit)
+            except Exception:
+                Metrics.count("prefetch.failed")
+
+        async def _run_async(unit: FetchUnit):
+            if not _allowed(unit):
+                return
+            done.add(unit.key)
+            try:
+                async with CollectorPool.lease_async(unit.collector) as collector:
+                    await collector.fetch_unit(unit)
+            except Exception:
+                Metrics.count("prefetch.failed")
+
+        for _ in self.executor().run(plan.units.values(), _run, _run_async):
+            pass
+        return done
+
+    def _search_for_options(self, options: FlightOptions, queries: Iterable[PlannedQuery],
+                            fetched: datetime, sink: ResultSink | None = None, budget: BudgetClock | None = None,
+                            skipped: set[str] | None = None, failed: set[str] | None = None) -> Iterable[QueryResult]:
+        # Queries of collectors that don't declare their fetches are charged to the budget here;
+        # the ones it refuses are added to `skipped`, and the ones whose collection raises to `failed`
+        def _allowed(query: PlannedQuery) -> bool:
+            return budget is None or bool(query.collector.fetch_units(query.search)) or budget.take()
+
+        def _results(query: PlannedQuery, trips: list[Trip], start: float) -> tuple[str, list[QueryResult]]:
+            key = query.key()
+            collected = time.perf_counter()
+            with Metrics.timed("filter"):
+                kept = SearchFilter.filter_trips(options.filters, trips,
+                                                 trip_level_only=query.collector.FILTERS_FLIGHTS)
+            Metrics.count("trips.collected", len(trips))
+            Metrics.count("trips.filtered", len(trips) - len(kept))
+            Metrics.query(plan=options.name, collector=query.collector.__name__, key=key,
+                          collect_seconds=collected - start, filter_seconds=time.perf_counter() - collected,
+                          trips=len(trips), kept=len(kept))
+            return key, [QueryResult(collector=query.collector, trip=t, key=key) for t in kept]
+
+        def _run(query: PlannedQuery) -> tuple[str, list[QueryResult] | Exception | None]:
+            if not _allowed(query):
+                return query.key(), None
+            start = time.perf_counter()
+            try:
+                with CollectorPool.lease(query.collector) as collector:
+                    trips = list(collector.collect(query.search))
+            except Exception as e:
+                Metrics.error(query.collector.__name__, e, key=query.key())
+                return query.key(), e
+            return _results(query, trips, start)
+
+        async def _run_async(query: PlannedQuery) -> tuple[str, list[QueryResult] | Exception | None]:
+            if not _allowed(query):
+                return query.key(), None
+            start = time.perf_counter()
+            try:
+                async with CollectorPool.lease_async(query.collector) as collector:
+                    trips = [t async for t in collector.collect(query.search)]
+            except Exception as e:
+                Metrics.error(query.collector.__name__, e, key=query.key())
+                return query.key(), e
+            return _results(query, trips, start)
+
+        queries = {q.key(): q for q in queries}
+        for key, results in self.executor().run(queries.values(), _run, _run_async):
+            if results is None:
+                if skipped is not None:
+                    skipped.add(key)
+                continue
+            if isinstance(results, Exception):
+                if failed is not None:
+                    failed.add(key)
+                continue
+            if sink is not None:
+                provided = FetchMemo.active is None or self._provided(queries[key], FetchMemo.active)
+                sink.write_query(options.name, key, fetched if provided else None, results)
+            yield from results
 
     def _rank(self, queries: Iterable[QueryResult]) -> Iterable[ScoredQueryResult]:
-        yield from self.ranker.rank(queries)
+        yield from self.ranker.rank(self._prune(queries), top_k=self.top_k)
+
+    def _prune(self, queries: Iterable[QueryResult]) -> list[QueryResult]:
+        queries = list(queries)
+        if self.pruner is None:
+            return queries
+        with Metrics.timed("prune"):
+            kept = self.pruner.prune(queries)
+        Metrics.count("trips.pruned", len(queries) - len(kept))
+        return kept
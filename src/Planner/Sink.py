@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Iterable, Iterator, TextIO
+import json
+import os
+
+from Planner.Query import QueryResult, PlanResult
+from Planner.Ranking import Ranker, DefaultRanker
+from Planner.Pruning import Pruner
+
+
+#
+
+
+class ResultSink(ABC):
+    # Receives results from SearchPlan.search/refresh as they're produced: every query's results as
+    # soon as the query finishes, and every ranked PlanResult once its options are done.  A query's
+    # `fetched` is None when its data came from a cache rather than its provider.
+
+    @abstractmethod
+    def write_query(self, name: str, key: str, fetched: datetime | None, results: list[QueryResult]):
+        ...
+
+    @abstractmethod
+    def write_plan(self, result: PlanResult):
+        ...
+
+    def close(self):
+        ...
+
+    def __enter__(self) -> ResultSink:
+        return self
+
+    def __exit__(self, *_) -> bool:
+        self.close()
+        return False
+
+
+#
+
+
+class JSONLinesSink(ResultSink):
+    # Appends one JSON record per line and syncs it to disk before returning, so everything written
+    # survives a crash.  With `queries=False` only finished PlanResults are kept.
+
+    def __init__(self, path: str, queries: bool = True, mode: str = "a"):
+        self.path = path
+        self.queries = queries
+        self._file: TextIO = open(path, mode, encoding="utf-8")
+
+    def write_query(self, name: str, key: str, fetched: datetime | None, results: list[QueryResult]):
+        if self.queries:
+            self._write({"type": "query", "plan": name, "key": key,
+                         "fetched": None if fetched is None else fetched.isoformat(),
+                         "results": [r.to_json() for r in results]})
+
+    def write_plan(self, result: PlanResult):
+        self._write({"type": "plan", "result": result.to_json()})
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+    @classmethod
+    def records(cls, path: str) -> Iterator[dict]:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    break  # a line cut short by a crash; nothing after it was synced
+
+    @classmethod
+    def load(cls, path: str, ranker: Ranker | None = None, pruner: Pruner | None = None,
+             top_k: int | None = None, previous: Iterable[PlanResult] = ()) -> list[PlanResult]:
+        # Finished PlanResults as written.  Options that never finished are rebuilt from their query
+        # records on top of `previous` (the results the run started from), pruned and ranked like the
+        # plan would have (pass its ranker, pruner and top_k), and can be passed to
+        # SearchPlan.refresh to pick up where the run stopped.  Options the run never got to are
+        # returned from `previous` as they were.
+        started = {pr.name: pr for pr in previous}
+        plans: dict[str, PlanResult] = {}
+        partial: dict[str, dict[str, tuple[datetime | None, list[dict]]]] = {}
+        for record in cls.records(path):
+            if record["type"] == "plan":
+                result = PlanResult.from_json(record["result"])
+                plans[result.name] = result
+                partial.pop(result.name, None)
+            elif record["type"] == "query":
+                partial.setdefault(record["plan"], {})[record["key"]] = \
+                    (None if record["fetched"] is None else datetime.fromisoformat(record["fetched"]),
+                     record["results"])
+
+        ranker = ranker or DefaultRanker()
+        for name, queries in partial.items():
+            # Query records newer than the options' last finished result replace that query's rows
+            results: list[QueryResult] = [QueryResult.from_json(r) for _, rs in queries.values() for r in rs]
+            fetched = {k: fetched for k, (fetched, _) in queries.items() if fetched is not None}
+            if (base := plans.get(name, started.get(name))) is not None:
+                results += [sqr.query for sqr in base.results if sqr.query.key not in queries]
+                fetched = {**{k: f for k, f in base.fetched.items() if k not in queries}, **fetched}
+            if pruner is not None:
+                results = pruner.prune(results)
+            plans[name] = PlanResult(name=name, results=list(ranker.rank(results, top_k=top_k)), fetched=fetched)
+        return list(plans.values()) + [pr for name, pr in started.items() if name not in plans]
@@ -2,3 +2,9 @@ from Planner.SearchPlan import SearchPlan, PlanResult
 from Planner.Query import PlannedQuery, QueryResult, ScoredQueryResult
 from Planner.Restrictions import SearchRestriction, CollectorJourneyRestriction, CollectorLegRestriction
 from Planner.Ranking import Ranker, DefaultRanker
+from Planner.Pruning import Pruner, ParetoPruner, PruneObjective, PriceObjective, DurationObjective, \
+    LayoverObjective
+from Planner.FetchPlan import FetchPlan
+from Planner.Budget import QueryBudget, BudgetClock
+from Planner.ResultStore import ResultFile, write_results, load_results, yaml_to_results, results_to_yaml
+from Planner.Sink import ResultSink, JSONLinesSink